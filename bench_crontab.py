@@ -0,0 +1,204 @@
+"""
+Benchmarks for crontab.py.
+
+  python bench_crontab.py run [--sizes 10,1000,10000,100000] [--repeat 3]
+                              [--output results.json]
+  python bench_crontab.py compare old.json new.json [--threshold 0.1]
+  python bench_crontab.py memory [lines]
+
+run     - time parse, render, find, remove, schedule and a day of occurrences
+          on synthetic tabs and record their peak memory; results are
+          printed and optionally saved as JSON
+compare - show the change between two saved runs, exiting with 1 if any
+          operation got slower by more than the threshold
+memory  - bytes of Python objects kept per parsed crontab line
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from crontab import CronTab
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+try:
+  import resource
+except ImportError:
+  resource = None
+
+SCHEDULES = [
+  '0 * * * *', '*/5 * * * *', '30 2 * * *', '0 9-17 * * mon-fri',
+  '15,45 */2 * * *', '0 0 1 * *', '0 4 * jan,jul sun', '*/10 8-18/2 * * 1-5',
+  '0 6 1-7 * mon', '5 */4 * mar-oct *',
+]
+SPECIAL_SCHEDULES = ['@hourly', '@daily', '@weekly', '@monthly', '@reboot']
+DEFAULT_SIZES = [10, 1000, 10000, 100000]
+SCHEDULE_FROM = datetime(2026, 1, 1)
+
+def synthetic_tab(lines, seed=0):
+  """Return the text of a crontab with a realistic mix of job lines."""
+  rand = random.Random(seed)
+  result = []
+  for n in range(lines):
+    roll = rand.random()
+    if roll < 0.05:
+      result.append('# comment line %d' % n)
+    elif roll < 0.15:
+      result.append('%s /usr/local/bin/task%d' % (
+          rand.choice(SPECIAL_SCHEDULES), n))
+    elif roll < 0.5:
+      result.append('%s /usr/bin/job%d --flag >/dev/null 2>&1 # id%d' % (
+          rand.choice(SCHEDULES), n, n))
+    else:
+      result.append('%d %d-%d * * %s /opt/app/run%d' % (
+          rand.randint(0, 59), rand.randint(0, 11), rand.randint(12, 23),
+          rand.choice(['*', 'mon-fri', '0,6', '*/2']), n))
+  return '\n'.join(result) + '\n'
+
+def parse(text):
+  return CronTab(tab=text).crons
+
+def parse_lazy(text):
+  return CronTab(tab=text, lazy=True)
+
+def render(text):
+  return CronTab(tab=text).render
+
+def find_command(text):
+  tab = CronTab(tab=text)
+  return lambda: tab.find_command('/usr/bin/job%d ' % (len(tab.lines) // 2))
+
+def remove_all(text):
+  tab = CronTab(tab=text)
+  return lambda: tab.remove_all('/usr/bin/job')
+
+def schedule(text):
+  jobs = [job for job in CronTab(tab=text) if not job.special]
+  def next_times():
+    for job in jobs:
+      job.schedule(SCHEDULE_FROM).get_next()
+  return next_times
+
+def occurrences(text):
+  tab = CronTab(tab=text)
+  tab.crons
+  return lambda: tab.occurrences(SCHEDULE_FROM, SCHEDULE_FROM + timedelta(days=1))
+
+# name -> (setup, takes_setup_result). Operations whose setup returns a
+# callable only time that callable; the others time the setup itself.
+OPERATIONS = [
+  ('parse', parse, False),
+  ('parse_lazy', parse_lazy, False),
+  ('render', render, True),
+  ('find_command', find_command, True),
+  ('remove_all', remove_all, True),
+  ('schedule', schedule, True),
+  ('occurrences', occurrences, True),
+]
+
+def measure(setup, prepared, text, repeat):
+  """Return (best seconds, peak bytes or None) for one operation."""
+  best = None
+  for _ in range(repeat):
+    call = setup(text) if prepared else (lambda: setup(text))
+    gc.collect()
+    start = time.time()
+    call()
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  peak = None
+  if tracemalloc is not None:
+    call = setup(text) if prepared else (lambda: setup(text))
+    gc.collect()
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  elif resource is not None:
+    # Without tracemalloc only the process high-water mark is available, so
+    # this grows with the largest operation run so far (kilobytes on Linux).
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+  return best, peak
+
+def run(args):
+  results = []
+  for lines in args.sizes:
+    text = synthetic_tab(lines)
+    for (name, setup, prepared) in OPERATIONS:
+      seconds, peak = measure(setup, prepared, text, args.repeat)
+      results.append({'op': name, 'lines': lines, 'seconds': seconds,
+                      'peak_bytes': peak})
+      print('%-13s %7d lines %10.4fs %12s bytes peak' % (
+          name, lines, seconds, peak if peak is not None else '-'))
+      sys.stdout.flush()
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump({'python': platform.python_version(),
+                 'created': datetime.now().isoformat(),
+                 'results': results}, output, indent=2)
+
+def compare(args):
+  def load(path):
+    with open(path) as results:
+      return dict(((r['op'], r['lines']), r) for r in json.load(results)['results'])
+  old, new = load(args.old), load(args.new)
+  slower = 0
+  for key in sorted(set(old) & set(new), key=lambda key: (key[1], key[0])):
+    change = new[key]['seconds'] / max(old[key]['seconds'], 1e-9) - 1
+    flag = ''
+    if change > args.threshold:
+      flag = '  SLOWER'
+      slower += 1
+    print('%-13s %7d lines %10.4fs -> %10.4fs %+7.1f%%%s' % (
+        key[0], key[1], old[key]['seconds'], new[key]['seconds'],
+        change * 100, flag))
+  return 1 if slower else 0
+
+def bytes_per_line(lines):
+  if tracemalloc is None:
+    sys.exit('The memory benchmark needs tracemalloc (Python 3.4+)')
+  text = synthetic_tab(lines)
+  gc.collect()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  tab = CronTab(tab=text)
+  tab.crons
+  gc.collect()
+  used = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  return float(used) / lines
+
+def memory(args):
+  print('%d lines: %.0f bytes per parsed line' % (
+      args.lines, bytes_per_line(args.lines)))
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  commands = parser.add_subparsers(dest='command')
+  run_args = commands.add_parser('run')
+  run_args.add_argument('--sizes', default=DEFAULT_SIZES,
+      type=lambda sizes: [int(size) for size in sizes.split(',')])
+  run_args.add_argument('--repeat', type=int, default=3)
+  run_args.add_argument('--output')
+  compare_args = commands.add_parser('compare')
+  compare_args.add_argument('old')
+  compare_args.add_argument('new')
+  compare_args.add_argument('--threshold', type=float, default=0.1)
+  memory_args = commands.add_parser('memory')
+  memory_args.add_argument('lines', type=int, nargs='?', default=10000)
+  args = parser.parse_args(argv)
+  command = {'run': run, 'compare': compare, 'memory': memory}.get(args.command)
+  if command is None:
+    parser.error('choose one of run, compare or memory')
+  return command(args)
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""
+Startup-time benchmark for the modules a cron tick loads.
+
+  python bench_startup.py [--repeat 5] [--top 5] [--budget-ms N]
+                          [--config CONFIG] [modules ...]
+
+For each module (crontab and send_email by default) this runs a fresh
+interpreter with -X importtime and reports the best cumulative import time
+and the slowest modules it pulled in. With --config it also times a whole
+send_email.py run against that config; point it at a schedule with nobody
+due to measure the fast path. Exits with 1 if any import takes longer than
+--budget-ms.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ['crontab', 'send_email']
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def parse_importtime(stderr):
+  """
+  Return [(cumulative us, self us, module, depth)] from -X importtime
+  output. Each module is listed after the modules it imported, which are
+  one level deeper.
+  """
+  rows = []
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    own, cumulative, name = line[len('import time:'):].split('|')
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    rows.append((int(cumulative), int(own), name.strip(), depth))
+  return rows
+
+def imported_by(rows, position):
+  """Return the rows for the modules imported by the one at position."""
+  depth = rows[position][3]
+  start = position
+  while start > 0 and rows[start - 1][3] > depth:
+    start -= 1
+  return rows[start:position]
+
+def run(args):
+  start = time.time()
+  process = subprocess.Popen([sys.executable] + args, cwd=HERE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+  stderr = process.communicate()[1]
+  return time.time() - start, stderr
+
+def import_time(module, repeat):
+  """
+  Return (best cumulative seconds, heaviest imports of that run). Without
+  -X importtime (Python 2) the import is timed from outside instead, less
+  the time to start an interpreter that imports nothing.
+  """
+  if sys.version_info < (3, 7):
+    empty = min(run(['-c', 'pass'])[0] for _ in range(repeat))
+    loaded = min(run(['-c', 'import %s' % module])[0] for _ in range(repeat))
+    return loaded - empty, []
+  best = None
+  for _ in range(repeat):
+    rows = parse_importtime(run(['-X', 'importtime', '-c',
+                                 'import %s' % module])[1])
+    positions = [n for (n, row) in enumerate(rows) if row[2] == module]
+    if positions and (best is None or rows[positions[-1]][0] < best[0]):
+      best = (rows[positions[-1]][0], imported_by(rows, positions[-1]))
+  if best is None:
+    raise RuntimeError('could not import %s' % module)
+  return best[0] / 1e6, sorted(best[1], reverse=True)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--top', type=int, default=5)
+  parser.add_argument('--budget-ms', type=float)
+  parser.add_argument('--config')
+  args = parser.parse_args(argv)
+
+  over = 0
+  for module in args.modules:
+    seconds, children = import_time(module, args.repeat)
+    flag = ''
+    if args.budget_ms is not None and seconds * 1000 > args.budget_ms:
+      flag = '  OVER BUDGET'
+      over += 1
+    print('import %-12s %8.1fms%s' % (module, seconds * 1000, flag))
+    for cumulative, _, name, _ in children[:args.top]:
+      print('  %-30s %8.1fms' % (name, cumulative / 1000.0))
+  if args.config:
+    seconds = min(run(['send_email.py', os.path.abspath(args.config)])[0]
+                  for _ in range(args.repeat))
+    print('send_email.py run      %8.1fms' % (seconds * 1000))
+  return 1 if over else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
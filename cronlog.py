@@ -0,0 +1,216 @@
+"""
+Read cron's entries in the syslog, newest first.
+
+The log is read backwards through mmap in fixed-size blocks, so asking for
+the latest runs of a job only touches the end of a large log. An optional
+index file remembers the offsets of every cron run seen so far; queries
+with an index only scan what was appended since the last one.
+"""
+
+import os, re, sys
+import json
+import mmap
+import zlib
+
+DEFAULT_LOG = '/var/log/syslog'
+BLOCK_SIZE = 64 * 1024
+INDEX_VERSION = 1
+# How much of the start of the log identifies it, to notice rotation.
+HEAD_SIZE = 256
+
+MATCHER = re.compile(
+    br'^(?P<date>\w{3} +\d+ +\d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\S+) '
+    br'(?P<host>\S+) CRON\[(?P<pid>\d+)\]: \((?P<user>[^)]+)\) '
+    br'CMD \((?P<cmd>.*)\)\s*$')
+
+if sys.version_info[0] == 3:
+    unicode = str
+
+
+def _decode(value):
+    return value.decode('utf-8', 'replace')
+
+
+class LogReader(object):
+    """Reads the lines of a log file backwards, a block at a time."""
+    def __init__(self, filename, block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.block_size = block_size
+
+    def _open(self):
+        """Return the file mapped into memory, or None if it is empty"""
+        with open(self.filename, 'rb') as fhl:
+            if not os.fstat(fhl.fileno()).st_size:
+                return None
+            return mmap.mmap(fhl.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def backwards(self, start=0, end=None):
+        """Yield (offset, line) for each line between start and end, last first"""
+        data = self._open()
+        if data is None:
+            return
+        try:
+            pos = len(data) if end is None else end
+            carry = b''
+            while pos > start:
+                block_start = max(start, pos - self.block_size)
+                lines = (data[block_start:pos] + carry).split(b'\n')
+                line_end = pos + len(carry)
+                for line in reversed(lines[1:]):
+                    line_end -= len(line)
+                    if line:
+                        yield line_end, line
+                    line_end -= 1
+                # The first line may carry on into the block before this one
+                carry = lines[0]
+                pos = block_start
+            if carry:
+                yield start, carry
+        finally:
+            data.close()
+
+    def line_at(self, data, offset):
+        end = data.find(b'\n', offset)
+        return data[offset:end if end >= 0 else len(data)]
+
+    def __iter__(self):
+        for (_, line) in self.backwards():
+            yield _decode(line)
+
+
+class CronLog(LogReader):
+    """
+    The cron runs in a syslog, newest first, as dicts of date, host, pid,
+    user, cmd and the offset of the line.
+
+    filename - The log to read (defaults to /var/log/syslog)
+    user     - Only include runs for this user
+    index    - File to keep an offset index in, to make queries incremental
+    """
+    def __init__(self, filename=None, user=None, index=None,
+                 block_size=BLOCK_SIZE):
+        LogReader.__init__(self, filename or DEFAULT_LOG, block_size)
+        self.user = user
+        self.index = index
+
+    def for_program(self, command):
+        """Return the runs of just this command"""
+        return ProgramLog(self, command)
+
+    def __iter__(self):
+        return self.runs()
+
+    def runs(self, command=None):
+        """Yield the runs for self.user and command, newest first"""
+        if self.index:
+            return self._indexed_runs(command)
+        return self._streamed_runs(command)
+
+    def _streamed_runs(self, command):
+        # Cheap substring tests skip most lines before the regex is tried
+        needles = [b'CRON[']
+        if self.user is not None:
+            needles.append(b'(' + self.user.encode('utf-8') + b') CMD (')
+        if command is not None:
+            needles.append(b'CMD (' + command.encode('utf-8') + b')')
+        for offset, line in self.backwards():
+            if all(needle in line for needle in needles):
+                run = self._parse(offset, line)
+                if run and self._wanted(run, command):
+                    yield run
+
+    def _indexed_runs(self, command):
+        index = self.update_index()
+        offsets = []
+        for key, found in index['runs'].items():
+            user, cmd = key.split('\t', 1)
+            if (self.user is None or user == self.user) and \
+                    (command is None or cmd == command):
+                offsets.extend(found)
+        if not offsets:
+            return
+        data = self._open()
+        try:
+            for offset in sorted(offsets, reverse=True):
+                run = self._parse(offset, self.line_at(data, offset))
+                if run:
+                    yield run
+        finally:
+            data.close()
+
+    def _wanted(self, run, command):
+        return (self.user is None or run['user'] == self.user) and \
+            (command is None or run['cmd'] == command)
+
+    def _parse(self, offset, line):
+        match = MATCHER.match(line)
+        if not match:
+            return None
+        run = dict((key, _decode(value))
+                   for (key, value) in match.groupdict().items())
+        run['offset'] = offset
+        return run
+
+    def update_index(self):
+        """
+        Add the runs appended to the log since the index was last updated,
+        save it and return it. The index starts again if the log was
+        rotated or truncated.
+        """
+        index = self._load_index()
+        data = self._open()
+        if data is None:
+            head, end = 0, 0
+        else:
+            try:
+                head = zlib.crc32(data[:HEAD_SIZE]) & 0xffffffff
+                # Only index complete lines; the last may still be written
+                end = data.rfind(b'\n') + 1
+            finally:
+                data.close()
+        stat = os.stat(self.filename)
+        if index is None or index['inode'] != stat.st_ino or \
+                index['head'] != head or index['size'] > end:
+            index = {'version': INDEX_VERSION, 'size': 0, 'runs': {}}
+        index['inode'], index['head'] = stat.st_ino, head
+        if index['size'] < end:
+            new_runs = []
+            for offset, line in self.backwards(index['size'], end):
+                if b'CRON[' in line:
+                    run = self._parse(offset, line)
+                    if run:
+                        new_runs.append(run)
+            for run in reversed(new_runs):
+                key = '%s\t%s' % (run['user'], run['cmd'])
+                index['runs'].setdefault(key, []).append(run['offset'])
+            index['size'] = end
+            self._save_index(index)
+        return index
+
+    def _load_index(self):
+        try:
+            with open(self.index) as fhl:
+                index = json.load(fhl)
+        except (IOError, OSError, ValueError):
+            return None
+        if index.get('version') != INDEX_VERSION:
+            return None
+        return index
+
+    def _save_index(self, index):
+        tmp_path = '%s.%d.tmp' % (self.index, os.getpid())
+        with open(tmp_path, 'w') as fhl:
+            json.dump(index, fhl)
+        os.rename(tmp_path, self.index)
+
+
+class ProgramLog(object):
+    """The runs of one command in a CronLog, newest first"""
+    def __init__(self, log, command):
+        if hasattr(command, 'command'):
+            command = command.command()
+        self.log = log
+        self.command = unicode(command).strip()
+
+    def __iter__(self):
+        return self.log.runs(self.command)
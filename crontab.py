@@ -64,26 +64,58 @@ cron.remove_all('echo')
 cron.remove_all('/foo/bar')
 cron.write()
 
-# Croniter Extentions allow you to ask for the scheduled job times, make
-# sure you have croniter installed, it's not a hard dependancy.
+# Ask for the scheduled job times, computed directly from the time slices.
 
 job3.schedule().get_next()
 job3.schedule().get_prev()
 
+# Every fire time of every job over the next 30 days, as (job, time) arrays.
+
+from datetime import datetime, timedelta
+jobs, times = cron.occurrences(datetime.now(), datetime.now() + timedelta(30))
+
+# How many jobs fire in each minute of the hour, and spreading the jobs that
+# all fire at :00 across the hour by a hash of their command.
+
+histogram = cron.minute_histogram()
+moved, peak_before, peak_after = cron.stagger()
+
+# Read, change and write many users' crontabs at once, collecting errors.
+
+from crontab import edit_crontabs
+tabs, errors = edit_crontabs(['www-data', 'backup'],
+                             lambda tab: tab.remove_all('echo'))
+
 """
 
-import os, re, sys
-import tempfile
-import subprocess as sp
+import os, sys
+import time
+import functools
+import itertools
+import threading
 
-from datetime import datetime
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
 __pkgname__ = 'python-crontab'
 __version__ = '1.5.1'
 
-ITEMREX = re.compile('^\s*([^@#\s]+)\s+([^@#\s]+)\s+([^@#\s]+)' +
+class _LazyRegex(object):
+    """A regular expression that is only compiled when first used"""
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __getattr__(self, name):
+        import re
+        # Keep the compiled method so later lookups skip __getattr__
+        value = getattr(re.compile(self.pattern), name)
+        setattr(self, name, value)
+        return value
+
+ITEMREX = _LazyRegex('^\s*([^@#\s]+)\s+([^@#\s]+)\s+([^@#\s]+)' +
     '\s+([^@#\s]+)\s+([^@#\s]+)\s+([^#\n]*)(\s+#\s*([^\n]*)|$)')
-SPECREX = re.compile('@(\w+)\s([^#\n]*)(\s+#\s*([^\n]*)|$)')
+SPECREX = _LazyRegex('@(\w+)\s([^#\n]*)(\s+#\s*([^\n]*)|$)')
 DEVNULL = ">/dev/null 2>&1"
 
 MONTH_ENUM = [ None,
@@ -107,6 +139,10 @@ SPECIALS = {
     "midnight": '0 0 * * *'
 }
 
+# Name to render each special time pattern as, where there is a choice
+SPECIAL_NAMES = dict((SPECIALS[name], '@' + name) for name in
+    ('hourly', 'daily', 'weekly', 'monthly', 'yearly'))
+
 S_INFO = [
     { 'name' : 'Minutes',      'max_v' : 59, 'min_v' : 0 },
     { 'name' : 'Hours',        'max_v' : 23, 'min_v' : 0 },
@@ -116,10 +152,18 @@ S_INFO = [
 ]
 
 # Detect Python3 and which OS for temperments.
-import platform
-py3 = platform.python_version()[0] == '3'
-WinOS = platform.system() == 'Windows'
-SystemV = not WinOS and (os.uname()[0] in ["SunOS","AIX","HP-UX"] or os.getenv('SystemV_TEST'))
+py3 = sys.version_info[0] == 3
+WinOS = sys.platform == 'win32'
+_system_v = None
+
+def system_v():
+    """Older unixes want plain value lists; checked on first use"""
+    global _system_v
+    if _system_v is None:
+        _system_v = not WinOS and bool(
+            os.uname()[0] in ["SunOS","AIX","HP-UX"] or os.getenv('SystemV_TEST'))
+    return _system_v
+
 CRONCMD = "/usr/bin/crontab"
 if sys.argv[0].startswith('test_'):
     CRONCMD = './data/crontest'
@@ -128,19 +172,22 @@ if py3:
     unicode = str
     basestring = str
 
-try:
-    # Croniter is an optional import
-    from croniter.croniter import croniter as _croniter
-    class croniter(_croniter):
-        """Same as normal croniter, but always return datetime objects"""
-        def get_next(self, type_ref=datetime):
-            return _croniter.get_next(self, type_ref)
-        def get_prev(self, type_ref=datetime):
-            return _croniter.get_prev(self, type_ref)
-        def get_current(self, type_ref=datetime):
-            return _croniter.get_current(self, type_ref)
-except ImportError:
-    croniter = None
+ONE_MINUTE = timedelta(minutes=1)
+ONE_HOUR = timedelta(hours=1)
+ONE_DAY = timedelta(days=1)
+# Every dom/dow combination repeats within 28 years, so a job with no fire
+# time inside that window will never fire.
+MAX_YEARS = 28
+
+# How many distinct sets of time fields to keep parsed slices for. Jobs
+# with the same time fields share one read-only set of slices.
+SCHEDULE_CACHE_SIZE = 4096
+# How many crontab commands the bulk functions run at once.
+BULK_WORKERS = 8
+# Days of firings that the load histogram and stagger look at by default.
+STAGGER_DAYS = 7
+# array.array type for the timestamps from CronTab.occurrences
+_TIME_TYPECODE = 'q' if sys.version_info[0] == 3 else 'l'
 
 
 class CronTab(object):
@@ -151,12 +198,17 @@ class CronTab(object):
     tab     - Use a string variable as the crontab instead of installed crontab
     tabfile - Use a file for the crontab instead of installed crontab
     log     - Filename for logfile instead of /var/log/syslog
+    lazy    - Only parse a line when its job is first used (see read)
+    check   - Raise IOError when the crontab command fails
 
     """
-    def __init__(self, user=None, tab=None, tabfile=None, log=None):
-        self.lines = None
-        self.crons = None
+    def __init__(self, user=None, tab=None, tabfile=None, log=None,
+                 lazy=False, check=False):
+        self._lines = []
+        self._crons = []
         self.filen = None
+        self.lazy  = lazy
+        self.check = check
         # Protect windows users
         self.root  = not WinOS and os.getuid() == 0
         self.user  = user
@@ -172,61 +224,131 @@ class CronTab(object):
             self._log = CronLog(self._log, user=self.user or 'root')
         return self._log
 
+    @property
+    def lines(self):
+        """Every line of the crontab, as CronItems or plain strings"""
+        self._parse_all()
+        self._compact()
+        return self._lines
+
+    @property
+    def crons(self):
+        """The valid cron jobs in this crontab"""
+        self._parse_all()
+        self._compact()
+        if self._crons is None:
+            self._crons = [line for line in self._lines
+                           if isinstance(line, CronItem)]
+        return self._crons
+
     def read(self, filename=None):
         """
         Read in the crontab from the system into the object, called
         automatically when listing or using the object. use for refresh.
+
+        In lazy mode lines are kept as text and only parsed when their job is
+        needed: iterating, crons and lines parse everything, while find_*
+        only parse lines whose text contains what is being looked for.
+        Lines that are never parsed, or never changed, render back exactly
+        as they were read.
         """
-        self.crons = []
-        self.lines = []
+        self._crons = None if self.lazy else []
+        self._lines = []
+        self._unparsed = 0
+        # id(item) -> position for every job in crons, and the ids of jobs
+        # removed since crons and lines were last compacted.
+        self._members = {}
+        self._removed = set()
+        self._count = 0
+        self._drop_index()
         if self.intab != None:
             lines = self.intab.split('\n')
+            self._saved = (None, self.intab)
         elif filename:
             self.filen = filename
             with open(filename, 'r') as fhl:
                 lines = fhl.readlines()
+            self._saved = (filename, ''.join(lines))
         else:
+            import subprocess as sp
             p = sp.Popen(self._read_execute(), stdout=sp.PIPE, stderr=sp.PIPE)
             (out, err) = p.communicate()
+            # Having no crontab yet is the same as having an empty one
+            if self.check and p.returncode and \
+                    not err.startswith(b'no crontab for'):
+                raise _command_error(self._read_execute(), p.returncode, err)
             lines = out.decode('utf-8').split("\n")
+            self._saved = (self.user or '', out.decode('utf-8'))
+        if self.lazy:
+            self._lines = [_RawLine(pos, line.replace('\n',''))
+                           for (pos, line) in enumerate(lines)]
+            self._unparsed = self._count = len(self._lines)
+            return
         for line in lines:
             cron = CronItem(line, cron=self)
             if cron.is_valid():
-                self.crons.append(cron)
-                self.lines.append(cron)
+                self._append(cron)
             else:
-                self.lines.append(line.replace('\n',''))
+                self._lines.append(line.replace('\n',''))
 
     def write(self, filename=None):
-        """Write the crontab to the system. Saves all information."""
+        """
+        Write the crontab to the system. Saves all information.
+
+        Nothing is written when the rendered crontab is the same as the text
+        last read from or written to the same place.
+        """
         if filename:
             self.filen = filename
+        text = self.render()
 
         # Add to either the crontab or the internal tab.
         if self.intab != None:
-          self.intab = self.render()
+          self.intab = text
           # And that's it if we never saved to a file
           if not self.filen:
               return
 
+        target = self.filen or self.user or ''
+        if self._saved == (target, text):
+            return
+
+        import tempfile
         if self.filen:
-            fileh = open(self.filen, 'w')
+            # Write next to the file and rename over it, so readers never see
+            # a half written crontab.
+            filed, path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.filen)))
         else:
             filed, path = tempfile.mkstemp()
-            fileh = os.fdopen(filed, 'w')
-
-        fileh.write(self.render())
+        fileh = os.fdopen(filed, 'w')
+        fileh.write(text)
         fileh.close()
 
-        if not self.filen:
+        if self.filen:
+            if os.path.exists(self.filen):
+                os.chmod(path, os.stat(self.filen).st_mode & 0o7777)
+                if WinOS:
+                    os.remove(self.filen)
+            os.rename(path, self.filen)
+        else:
             # Add the entire crontab back to the user crontab
-            sp.Popen(self._write_execute(path)).wait()
+            import subprocess as sp
+            p = sp.Popen(self._write_execute(path), stderr=sp.PIPE)
+            err = p.communicate()[1]
             os.unlink(path)
+            if p.returncode and self.check:
+                raise _command_error(self._write_execute(path),
+                                     p.returncode, err)
+            elif p.returncode:
+                sys.stderr.write(err.decode('utf-8', 'replace'))
+        self._saved = (target, text)
 
     def render(self):
         """Render this crontab as it would be in the crontab."""
         crons = []
-        for cron in self.lines:
+        self._compact()
+        for cron in self._lines:
             crons.append(unicode(cron))
         result = '\n'.join(crons)
         if result and result[-1] not in [ '\n', '\r' ]:
@@ -240,25 +362,22 @@ class CronTab(object):
         Returns the new CronItem object.
         """
         item = CronItem(command=command, meta=comment, cron=self)
-        self.crons.append(item)
-        self.lines.append(item)
+        self._append(item)
         return item
 
     def find_command(self, command):
         """Return a list of crons using a command."""
+        self._parse_all(command)
         result = []
-        for cron in self.crons:
-            if cron.command.match(command):
-                result.append(cron)
-        return result
+        for (text, items) in self._index()[0].items():
+            if command in text:
+                result.extend(items.values())
+        return self._in_order(result)
 
     def find_comment(self, comment):
         """Return a list of crons using the comment field."""
-        result = []
-        for cron in self.crons:
-            if cron.meta() == comment:
-                result.append(cron)
-        return result
+        self._parse_all(comment)
+        return self._in_order(self._index()[1].get(comment, {}).values())
 
     def remove_all(self, command):
         """Removes all crons using the stated command."""
@@ -267,12 +386,184 @@ class CronTab(object):
             self.remove(c_value)
 
     def remove(self, item):
-        """Remove a selected cron from the crontab."""
-        # The last item often has a trailing line feed
-        if self.crons[-1] == item and self.lines[-1] == '':
-            self.lines.remove(self.lines[-1])
-        self.crons.remove(item)
-        self.lines.remove(item)
+        """
+        Remove a selected cron from the crontab.
+
+        Items are matched by identity. crons and lines are only rebuilt the
+        next time they are used, so removing many items costs one pass.
+        """
+        if self._members.pop(id(item), None) is None:
+            raise ValueError("%s is not in this crontab" % repr(item))
+        self._removed.add(id(item))
+        if self._commands is not None:
+            for (index, key) in zip(self._index(), _index_keys(item)):
+                del index[key][id(item)]
+                if not index[key]:
+                    del index[key]
+
+    def occurrences(self, start, end, use_numpy=True):
+        """
+        Every fire time of every enabled job from start up to (not
+        including) end, as two arrays (jobs, times) in time order: the job
+        at crons[jobs[n]] fires at the unix timestamp times[n].
+
+        The arrays are NumPy arrays when NumPy can be imported (and
+        use_numpy is true), otherwise array.array. Jobs with the same times
+        are expanded once and copied, so large tabs cost little more than
+        their number of firings.
+        """
+        start_ts = time.mktime(start.timetuple())
+        end_ts = time.mktime(end.timetuple())
+        days = _fire_days(start, end)
+        groups = OrderedDict()
+        for (index, job) in enumerate(self.crons):
+            if job.special or not job.enabled:
+                continue
+            groups.setdefault(_time_key(job), []).append(index)
+
+        np = None
+        if use_numpy:
+            try:
+                import numpy as np
+            except ImportError:
+                pass
+        if np is not None:
+            return _numpy_occurrences(np, groups, days, start_ts, end_ts)
+        pairs = []
+        for (key, indexes) in groups.items():
+            times = [when for when in _day_times(key, days)
+                     if start_ts <= when < end_ts]
+            pairs.extend((when, index) for index in indexes for when in times)
+        pairs.sort()
+        from array import array
+        return (array('i', [index for (_, index) in pairs]),
+                array(_TIME_TYPECODE, [when for (when, _) in pairs]))
+
+    def minute_histogram(self, start=None, end=None):
+        """
+        How many jobs fire in each minute of the hour, over the window from
+        start to end (default the next STAGGER_DAYS days). Returns a list
+        of 60 counts, where index 0 is every firing at :00.
+        """
+        (start, end) = _window(start, end)
+        anchor = time.mktime(start.replace(minute=0).timetuple())
+        histogram = [0] * 60
+        for when in self.occurrences(start, end)[1]:
+            histogram[int((when - anchor) // 60 % 60)] += 1
+        return histogram
+
+    def peak_concurrency(self, start=None, end=None):
+        """The most jobs that fire in any one minute of the window"""
+        times = self.occurrences(*_window(start, end))[1]
+        if not len(times):
+            return 0
+        if hasattr(times, 'dtype'):
+            import numpy
+            return int(numpy.unique(times, return_counts=True)[1].max())
+        return max(len(list(group)) for (_, group) in
+                   itertools.groupby(times))
+
+    def stagger(self, jobs=None, hours=False, start=None, end=None):
+        """
+        Spread jobs pinned to the top of the hour across the hour, so they
+        stop all firing at :00. Opt-in; nothing changes until this is called.
+
+        Every enabled job (of jobs, if given) whose minute is just 0, as
+        every() and @hourly/@daily leave it, gets a minute picked from a
+        hash of its command, so the same command always lands on the same
+        minute. With hours=True, jobs whose hour is just 0 (daily and slower
+        jobs) also get an hour from the hash.
+
+        Returns (moved jobs, peak before, peak after), the peaks being
+        peak_concurrency over the window.
+        """
+        import zlib
+        (start, end) = _window(start, end)
+        before = self.peak_concurrency(start, end)
+        moved = []
+        for job in (self.crons if jobs is None else jobs):
+            if job.special or not job.enabled:
+                continue
+            (minute, hour) = job._slices[:2]
+            if minute.values() != [0]:
+                continue
+            offset = zlib.crc32(unicode(job.command).encode('utf-8')) \
+                & 0xffffffff
+            job.minute.on(offset % 60)
+            if hours and hour.values() == [0]:
+                job.hour.on(offset // 60 % 24)
+            moved.append(job)
+        return (moved, before, self.peak_concurrency(start, end))
+
+    def _append(self, item):
+        """Add a valid job to the end of the crontab"""
+        if self._crons is not None:
+            self._crons.append(item)
+        self._lines.append(item)
+        self._members[id(item)] = self._count
+        self._count += 1
+        if self._commands is not None:
+            self._add_to_index(item)
+
+    def _compact(self):
+        """Take removed items out of crons and lines"""
+        if not self._removed:
+            return
+        removed = self._removed
+        if self._crons is not None:
+            # The last item often has a trailing line feed
+            if self._crons and id(self._crons[-1]) in removed \
+                    and self._lines and self._lines[-1] == '':
+                self._lines.pop()
+            self._crons = [item for item in self._crons
+                           if id(item) not in removed]
+        self._lines = [line for line in self._lines if id(line) not in removed]
+        self._removed = set()
+
+    def _index(self):
+        """Return the command and comment indexes, {key: {id(item): item}}"""
+        if self._commands is None:
+            self._commands, self._comments = {}, {}
+            for item in self._lines:
+                if isinstance(item, CronItem) and id(item) in self._members:
+                    self._add_to_index(item)
+        return (self._commands, self._comments)
+
+    def _parse_all(self, text=''):
+        """In lazy mode, parse every unparsed line containing text"""
+        if not self._unparsed:
+            return
+        for (index, line) in enumerate(self._lines):
+            if isinstance(line, _RawLine) and text in line.text:
+                self._parse_line(index)
+
+    def _parse_line(self, index):
+        """Replace the raw line at index with its CronItem, if it is a job"""
+        raw = self._lines[index]
+        self._unparsed -= 1
+        item = CronItem(raw.text, cron=self)
+        if not item.is_valid():
+            self._lines[index] = raw.text
+            return
+        # Until it is changed, the job renders as the text it was read from
+        item._rendered = raw.text
+        self._lines[index] = item
+        self._members[id(item)] = raw.pos
+        if self._commands is not None:
+            self._add_to_index(item)
+
+    def _add_to_index(self, item):
+        for (index, key) in zip(self._index(), _index_keys(item)):
+            index.setdefault(key, {})[id(item)] = item
+
+    def _drop_index(self, item=None):
+        """Forget the find indexes, e.g. when a job's command changes"""
+        if item is None or id(item) in self._members:
+            self._commands = self._comments = None
+
+    def _in_order(self, items):
+        """Sort items by their place in the crontab"""
+        return sorted(items, key=lambda item: self._members[id(item)])
 
     def _read_execute(self):
         """Returns the command line for reading a crontab"""
@@ -298,19 +589,196 @@ class CronTab(object):
         return self.render()
 
 
+def _window(start, end):
+    """The time window to look at when none is given: from now on"""
+    start = (start or datetime.now()).replace(second=0, microsecond=0)
+    return (start, end or start + timedelta(days=STAGGER_DAYS))
+
+
+def _fire_days(start, end):
+    """
+    Return (month, day, day of week, [unix time of each hour]) for every day
+    from start to end. Hours come from mktime, so days with a daylight
+    saving change get the right times.
+    """
+    days = []
+    day = start.date()
+    while day <= end.date():
+        stamp = day.timetuple()[:3]
+        days.append((day.month, day.day, day.isoweekday() % 7,
+            [int(time.mktime(stamp + (hour, 0, 0, 0, 0, -1)))
+             for hour in range(24)]))
+        day += ONE_DAY
+    return days
+
+
+def _time_key(job):
+    """The parts of a job's time fields that decide when it fires"""
+    (minute, hour, dom, month, dow) = job._slices
+    return (tuple(minute.values()), tuple(hour.values()), dom.mask,
+            month.mask, dow.mask, not (dom.is_any() or dow.is_any()))
+
+
+def _day_matches(key, month, day, weekday):
+    """Like CronItem.matches, for one day"""
+    (_, _, dom_mask, month_mask, dow_mask, either) = key
+    if not month_mask >> month & 1:
+        return False
+    on_dom = dom_mask >> day & 1
+    on_dow = dow_mask >> weekday & 1
+    return bool(on_dom | on_dow) if either else bool(on_dom & on_dow)
+
+
+def _day_times(key, days):
+    """Yield every fire time of jobs with this time key, in order"""
+    (minutes, hours) = key[:2]
+    for (month, day, weekday, bases) in days:
+        if _day_matches(key, month, day, weekday):
+            for hour in hours:
+                base = bases[hour]
+                for minute in minutes:
+                    yield base + minute * 60
+
+
+def _numpy_occurrences(np, groups, days, start_ts, end_ts):
+    """CronTab.occurrences, with the expansion done by NumPy"""
+    bases = np.array([day[3] for day in days], dtype=np.int64)
+    all_jobs, all_times = [], []
+    for (key, indexes) in groups.items():
+        (minutes, hours) = key[:2]
+        fire_days = [n for (n, day) in enumerate(days)
+                     if _day_matches(key, *day[:3])]
+        if not fire_days or not minutes or not hours:
+            continue
+        times = (bases[np.ix_(fire_days, hours)][:, :, None] +
+                 np.array(minutes, dtype=np.int64) * 60).ravel()
+        times = times[(times >= start_ts) & (times < end_ts)]
+        all_times.append(np.tile(times, len(indexes)))
+        all_jobs.append(np.repeat(np.array(indexes, dtype=np.int32),
+                                  len(times)))
+    if not all_times:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+    jobs = np.concatenate(all_jobs)
+    times = np.concatenate(all_times)
+    order = np.lexsort((jobs, times))
+    return jobs[order], times[order]
+
+
+def _command_error(command, returncode, err):
+    """The IOError for a crontab command that failed"""
+    return IOError("%s failed with status %d: %s" % (' '.join(command),
+        returncode, err.decode('utf-8', 'replace').strip()))
+
+
+def _bulk(function, users, workers):
+    """
+    Call function(user) for every user on a pool of threads, which spend
+    their time waiting on crontab commands. Returns ({user: result},
+    {user: exception}).
+    """
+    try:
+        from queue import Queue, Empty
+    except ImportError:
+        from Queue import Queue, Empty
+    pending = Queue()
+    for user in users:
+        pending.put(user)
+    results, errors = {}, {}
+    def work():
+        while True:
+            try:
+                user = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                results[user] = function(user)
+            except Exception as error:
+                errors[user] = error
+    threads = [threading.Thread(target=work)
+               for _ in range(min(workers, len(users)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def read_crontabs(users, workers=BULK_WORKERS, lazy=False):
+    """
+    Read the crontabs of many users at once.
+
+    Returns ({user: CronTab}, {user: error}); a user whose crontab could not
+    be read is in the second dict only. The crontab command is CRONCMD,
+    which can be changed e.g. to use a test stand-in.
+    """
+    return _bulk(lambda user: CronTab(user=user, lazy=lazy, check=True),
+                 users, workers)
+
+
+def write_crontabs(tabs, workers=BULK_WORKERS):
+    """
+    Write a {user: CronTab} dict of crontabs at once, e.g. as returned by
+    read_crontabs. Returns {user: error} for those that could not be written.
+    """
+    def write(user):
+        tab = tabs[user]
+        check, tab.check = tab.check, True
+        try:
+            tab.write()
+        finally:
+            tab.check = check
+    return _bulk(write, list(tabs), workers)[1]
+
+
+def edit_crontabs(users, edit, workers=BULK_WORKERS, lazy=False):
+    """
+    Read each user's crontab, call edit(tab) on it and write it back, for
+    many users at once. Crontabs that edit leaves unchanged are not written.
+
+    Returns ({user: CronTab}, {user: error}), where an error can come from
+    reading, edit or writing.
+    """
+    def read_edit_write(user):
+        tab = CronTab(user=user, lazy=lazy, check=True)
+        edit(tab)
+        tab.write()
+        return tab
+    return _bulk(read_edit_write, users, workers)
+
+
+class _RawLine(object):
+    """A line of a lazily read crontab that hasn't been parsed yet"""
+    __slots__ = ('pos', 'text')
+
+    def __init__(self, pos, text):
+        self.pos  = pos
+        self.text = text
+
+    def __unicode__(self):
+        return self.text
+
+    def __str__(self):
+        return self.text
+
+
 class CronItem(object):
     """
     An item which objectifies a single line of a crontab and
     May be considered to be a cron job object.
     """
+    __slots__ = ('_rendered', 'valid', '_enabled', '_slices', '_special',
+                 'cron', '_meta', '_command', '_log')
+
     def __init__(self, line=None, command='', meta='', cron=None):
+        # Rendered line, kept until the job is changed
+        self._rendered = None
         self.valid = False
         self.enabled = True
-        self.slices  = []
         self.special = False
         self.cron  = cron
 
         self._meta   = meta
+        self._command = None
         self._log    = None
 
         self.set_slices()
@@ -318,7 +786,7 @@ class CronItem(object):
             self.parse(line.strip())
 
         elif command:
-            self.command = CronCommand(unicode(command))
+            self._command = CronCommand(unicode(command))
             self.valid = True
 
     def delete(self):
@@ -329,13 +797,14 @@ class CronItem(object):
 
     def parse(self, line):
         """Parse a cron line string and save the info as the objects."""
+        self._changed()
         if not line or line[0] == '#':
             self.enabled = False
             line = line[1:].strip()
         result = ITEMREX.findall(line)
         if result:
             o_value = result[0]
-            self.command = CronCommand(o_value[5])
+            self._command = CronCommand(o_value[5])
             self._meta   = o_value[7]
             try:
                 self.set_slices( o_value )
@@ -347,7 +816,7 @@ class CronItem(object):
             result = SPECREX.findall(line)
             if result and result[0][0] in SPECIALS:
                 o_value = result[0]
-                self.command = CronCommand(o_value[1])
+                self._command = CronCommand(o_value[1])
                 self._meta   = o_value[3]
                 value = SPECIALS[o_value[0]]
                 if value.find('@') != -1:
@@ -358,13 +827,24 @@ class CronItem(object):
 
     def set_slices(self, o_value=None):
         """Set the values of this slice set"""
-        self.slices = []
-        for i_value in range(0, 5):
-            if not o_value:
-                o_value = [None, None, None, None, None]
-            self.slices.append(
-                CronSlice(job=self, value=o_value[i_value],
-                    **S_INFO[i_value]))
+        self._changed()
+        if not o_value:
+            o_value = [None, None, None, None, None]
+        self._slices = _shared_slices(tuple(o_value[:5]))
+
+    @property
+    def slices(self):
+        """The five time slices of this job"""
+        # A tuple means the slices are shared with other jobs; take a copy
+        # before handing them out, since the caller may change them.
+        if isinstance(self._slices, tuple):
+            self._slices = [vslice._copy(self) for vslice in self._slices]
+        return self._slices
+
+    @slices.setter
+    def slices(self, value):
+        self._changed()
+        self._slices = value
 
     def enable(self, enabled=True):
         """Set if this cron job is enabled or not"""
@@ -372,6 +852,30 @@ class CronItem(object):
             self.enabled = enabled
         return self.enabled
 
+    @property
+    def enabled(self):
+        """False when this job is commented out"""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._changed()
+        self._enabled = value
+
+    @property
+    def special(self):
+        """The special time token (e.g. '@reboot') used instead of slices"""
+        return self._special
+
+    @special.setter
+    def special(self, value):
+        self._changed()
+        self._special = value
+
+    def _changed(self):
+        """Called on every change to the job, drops the rendered line"""
+        self._rendered = None
+
     def is_enabled(self):
         """Return true if this job is enabled (not commented out)"""
         return self.enabled
@@ -382,35 +886,47 @@ class CronItem(object):
 
     def render_time(self):
         """Return just numbered parts of this crontab"""
-        return ' '.join([ unicode(self.slices[i]) for i in range(0, 5) ])
+        return ' '.join([ unicode(self._slices[i]) for i in range(0, 5) ])
 
     def render_schedule(self):
         """Return just the first part of a cron job (the numbers or specials)"""
+        if self.special:
+            return self.special
         time = self.render_time()
-        if self.special or (time in SPECIALS.values() and not SystemV):
-            if self.special:
-                return self.special
-            else:
-                for (name, value) in SPECIALS.items():
-                    if value == time:
-                        return "@%s" % name
+        if not system_v():
+            return SPECIAL_NAMES.get(time, time)
         return time
 
     def render(self):
         """Render this set cron-job to a string"""
-        result = "%s %s" % (self.render_schedule(), unicode(self.command))
-        if self.meta():
-            result += " # " + self.meta()
-        if not self.enabled:
-            result = "# " + result
-        return result
+        if self._rendered is None:
+            result = "%s %s" % (self.render_schedule(), unicode(self.command))
+            if self.meta():
+                result += " # " + self.meta()
+            if not self.enabled:
+                result = "# " + result
+            self._rendered = result
+        return self._rendered
 
     def meta(self, value=None):
         """Return or set the meta value to replace the set values"""
         if value:
+            self._changed()
             self._meta = value
+            self.cron and self.cron._drop_index(self)
         return self._meta
 
+    @property
+    def command(self):
+        """The CronCommand this job runs"""
+        return self._command
+
+    @command.setter
+    def command(self, value):
+        self._changed()
+        self._command = value
+        self.cron and self.cron._drop_index(self)
+
     def every_reboot(self):
         """Set to every reboot instead of a time pattern: @reboot"""
         self.clear()
@@ -432,17 +948,33 @@ class CronItem(object):
     def clear(self):
         """Clear the special and set values"""
         self.special = None
-        for slice_v in self.slices:
-            slice_v.clear()
+        if isinstance(self._slices, tuple):
+            self.set_slices()
+        else:
+            for slice_v in self._slices:
+                slice_v.clear()
+
+    def matches(self, when):
+        """Return true if this job fires in the minute of the given datetime"""
+        if self.special:
+            return False
+        (minute, hour, dom, month, dow) = self._slices
+        if not (minute.mask >> when.minute & hour.mask >> when.hour
+                & month.mask >> when.month & 1):
+            return False
+        on_dom = dom.mask >> when.day & 1
+        on_dow = dow.mask >> (when.isoweekday() % 7) & 1
+        if dom.is_any() or dow.is_any():
+            return bool(on_dom & on_dow)
+        return bool(on_dom | on_dow)
 
     def schedule(self, date_from=None):
-        """Return a croniter schedule is available."""
+        """Return a CronSchedule for finding this job's fire times."""
         if not date_from:
             date_from = datetime.now()
-        if croniter:
-            return croniter(self.render_time(), date_from)
-        raise ImportError("Croniter is not available. Please install croniter"+\
-                         " python module via pip or your package manager")
+        if self.special == '@reboot':
+            raise ValueError("@reboot jobs have no time schedule")
+        return CronSchedule(self, date_from)
 
     @property
     def log(self):
@@ -507,6 +1039,113 @@ class CronItem(object):
         return self.render()
 
 
+class CronSchedule(object):
+    """
+    Fire times of a cron job, computed from its slices without croniter.
+
+    Provides the get_next, get_prev and get_current calls of a croniter
+    object. Searches skip whole months, days and hours that can't match
+    instead of stepping a minute at a time.
+    """
+    def __init__(self, item, date_from):
+        (minute, hour, dom, month, dow) = item._slices
+        self.minutes = minute.values()
+        self.hours = hour.values()
+        self.doms = set(dom.values())
+        self.months = month.values()
+        self.dows = set(dow.values())
+        # Standard cron: when both day fields are restricted, either may match
+        self.either_day = not dom.is_any() and not dow.is_any()
+        self.cur = date_from
+
+    def get_next(self, type_ref=datetime):
+        """Advance to and return the first fire time after the current one."""
+        start = self.cur.replace(second=0, microsecond=0) + ONE_MINUTE
+        self.cur = self._forward(start)
+        return self.get_current(type_ref)
+
+    def get_prev(self, type_ref=datetime):
+        """Go back to and return the last fire time before the current one."""
+        start = self.cur.replace(second=0, microsecond=0)
+        if start == self.cur:
+            start -= ONE_MINUTE
+        self.cur = self._backward(start)
+        return self.get_current(type_ref)
+
+    def get_current(self, type_ref=datetime):
+        """Return the current time of this schedule."""
+        if type_ref is float:
+            return time.mktime(self.cur.timetuple())
+        return self.cur
+
+    def _day_matches(self, when):
+        dom = when.day in self.doms
+        dow = when.isoweekday() % 7 in self.dows
+        if self.either_day:
+            return dom or dow
+        return dom and dow
+
+    def _forward(self, when):
+        """Return the first fire time at or after when."""
+        limit = when.year + MAX_YEARS
+        while when.year <= limit:
+            if when.month not in self.months:
+                i = bisect_right(self.months, when.month)
+                if i < len(self.months):
+                    when = when.replace(month=self.months[i], day=1,
+                                        hour=0, minute=0)
+                else:
+                    when = when.replace(year=when.year + 1,
+                        month=self.months[0], day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(when):
+                when = when.replace(hour=0, minute=0) + ONE_DAY
+                continue
+            i = bisect_left(self.hours, when.hour)
+            if i == len(self.hours):
+                when = when.replace(hour=0, minute=0) + ONE_DAY
+                continue
+            if self.hours[i] != when.hour:
+                when = when.replace(hour=self.hours[i], minute=0)
+            i = bisect_left(self.minutes, when.minute)
+            if i == len(self.minutes):
+                when = when.replace(minute=0) + ONE_HOUR
+                continue
+            return when.replace(minute=self.minutes[i])
+        raise ValueError("Job never fires after %s" % str(self.cur))
+
+    def _backward(self, when):
+        """Return the last fire time at or before when."""
+        limit = when.year - MAX_YEARS
+        while when.year >= limit:
+            if when.month not in self.months:
+                i = bisect_left(self.months, when.month)
+                if i > 0:
+                    year, month = when.year, self.months[i - 1]
+                else:
+                    year, month = when.year - 1, self.months[-1]
+                import calendar
+                day = calendar.monthrange(year, month)[1]
+                when = when.replace(year=year, month=month, day=day,
+                                    hour=23, minute=59)
+                continue
+            if not self._day_matches(when):
+                when = when.replace(hour=23, minute=59) - ONE_DAY
+                continue
+            i = bisect_right(self.hours, when.hour)
+            if i == 0:
+                when = when.replace(hour=23, minute=59) - ONE_DAY
+                continue
+            if self.hours[i - 1] != when.hour:
+                when = when.replace(hour=self.hours[i - 1], minute=59)
+            i = bisect_right(self.minutes, when.minute)
+            if i == 0:
+                when = when.replace(minute=59) - ONE_HOUR
+                continue
+            return when.replace(minute=self.minutes[i - 1])
+        raise ValueError("Job never fired before %s" % str(self.cur))
+
+
 class SimpleItemInterface(object):
     """Provide an interface to the job.every() method:
         Available Calls:
@@ -515,21 +1154,27 @@ class SimpleItemInterface(object):
        Once run all units will be cleared (set to *) then proceeding units
        will be set to '0' and the target unit will be set as every x units.
     """
+    __slots__ = ('job', 'unit')
+    # Slice index for each available call
+    UNITS = dict((name + plural, x) for (x, name) in
+        enumerate(['minute', 'hour', 'dom', 'month', 'dow'])
+        for plural in ('', 's'))
+
     def __init__(self, item, units):
         self.job = item
         self.unit = units
-        for (x, i) in enumerate(['minute', 'hour', 'dom', 'month', 'dow']):
-            setattr(self, i, self._set(x))
-            setattr(self, i+'s', self._set(x))
+
+    def __getattr__(self, name):
+        if name not in SimpleItemInterface.UNITS:
+            raise AttributeError(name)
+        return functools.partial(self._set, SimpleItemInterface.UNITS[name])
 
     def _set(self, target):
-        def innercall():
-            self.job.clear()
-            # Day-of-week is actually a level 2 set, not level 4.
-            for p in range(target == 4 and 2 or target):
-                self.job.slices[p].on('<')
-            self.job.slices[target].every(self.unit)
-        return innercall
+        self.job.clear()
+        # Day-of-week is actually a level 2 set, not level 4.
+        for p in range(target == 4 and 2 or target):
+            self.job.slices[p].on('<')
+        self.job.slices[target].every(self.unit)
 
     def year(self):
         """Special every year target"""
@@ -537,11 +1182,13 @@ class SimpleItemInterface(object):
             raise ValueError("Invalid value '%s', " % self.unit + \
                              "job may only be in '1' year.")
         self.job.clear()
-        self.job.special = '@yearly'
+        self.job.set_slices(SPECIALS['yearly'].split(' '))
 
 
 class CronSlice(object):
     """Cron slice object which shows a time pattern"""
+    __slots__ = ('name', 'min', 'max', 'job', 'enum', 'parts', '_mask', '_any')
+
     def __init__(self, name, min_v, max_v, enum=None, value=None, job=None):
         self.name  = name
         self.min   = min_v
@@ -549,12 +1196,18 @@ class CronSlice(object):
         self.job   = job
         self.enum  = enum
         self.parts = []
+        self._mask = None
+        self._any  = None
         if value:
             self._set_value(value)
 
     def _set_value(self, value):
         """Set values into the slice."""
+        self._changed()
         self.parts = []
+        if value == '*':
+            # Same as no parts at all, which saves a CronRange per field
+            return
         for part in value.split(','):
             if part.find("/") > 0 or part.find("-") > 0 or part == '*':
                 self.parts.append( self.get_range( part ) )
@@ -589,12 +1242,14 @@ class CronSlice(object):
 
     def every(self, n_value, also=False):
         """Set the every X units value"""
+        self._changed()
         not also and self.clear()
         self.parts.append( self.get_range( int(n_value) ) )
         return self.parts[-1]
 
     def on(self, *n_value, **opts):
         """Set the time values to the specified placements."""
+        self._changed()
         not opts.get('also', False) and self.clear()
         for av in n_value:
             self.parts += self._v(av),
@@ -602,25 +1257,72 @@ class CronSlice(object):
 
     def during(self, vfrom, vto, also=False):
         """Set the During value, which sets a range"""
+        self._changed()
         not also and self.clear()
         self.parts.append(self.get_range(self._v(vfrom), self._v(vto)))
         return self.parts[-1]
 
     @property
     def also(self):
-        class Also(object):
-            def every(s, *a):
-                return self.every(*a, also=True)
-            def on(s, *a):
-                return self.on(*a, also=True)
-            def during(s, *a):
-                return self.during(*a, also=True)
-        return Also()
+        """Add to the existing values instead of replacing them"""
+        return _AlsoInterface(self)
 
     def clear(self):
         """clear the slice ready for new vaues"""
+        self._changed()
         self.parts = []
 
+    def _copy(self, job):
+        """Return a copy of this slice belonging to job"""
+        result = CronSlice(self.name, self.min, self.max, self.enum, job=job)
+        result.parts = [isinstance(part, CronRange) and part._copy(result)
+                        or part for part in self.parts]
+        (result._mask, result._any) = (self._mask, self._any)
+        return result
+
+    def _changed(self):
+        """Called before every change to parts, drops the compiled mask"""
+        self._mask = None
+        self._any  = None
+        if self.job is not None:
+            self.job._changed()
+
+    @property
+    def mask(self):
+        """Integer with bit N set when this slice matches value N."""
+        if self._mask is None:
+            self._mask = sum(1 << value for value in self.values())
+        return self._mask
+
+    def values(self):
+        """Return the sorted integer values this slice matches."""
+        if not self.parts:
+            result = set(range(self.min, self.max + 1))
+        else:
+            result = set()
+            for part in self.parts:
+                if isinstance(part, CronRange):
+                    result.update(range(int(part.vfrom), int(part.vto) + 1,
+                                        part.seq))
+                else:
+                    result.add(int(part))
+        if self.enum is WEEK_ENUM and 7 in result:
+            # Sunday can be written as either 0 or 7
+            result.discard(7)
+            result.add(0)
+        return sorted(result)
+
+    def is_any(self):
+        """
+        Return true if this slice starts with '*', as in '*' or '*/2'. Like
+        cron, a spelt out range such as 1-31 does not count, even though it
+        matches the same values.
+        """
+        if self._any is None:
+            self._any = not self.parts or (
+                isinstance(self.parts[0], CronRange) and self.parts[0].star)
+        return self._any
+
     def get_range(self, *vrange):
         """Return a cron range for this slice"""
         return CronRange( self, *vrange )
@@ -644,6 +1346,57 @@ class CronSlice(object):
         return out
 
 
+class _AlsoInterface(object):
+    """Provide the slice.also.every/on/during calls"""
+    __slots__ = ('slice',)
+
+    def __init__(self, vslice):
+        self.slice = vslice
+
+    def every(self, *a):
+        return self.slice.every(*a, also=True)
+
+    def on(self, *a):
+        return self.slice.on(*a, also=True)
+
+    def during(self, *a):
+        return self.slice.during(*a, also=True)
+
+
+class _SharedJob(object):
+    """The job of shared slices, which refuses any change to them"""
+    __slots__ = ()
+
+    def _changed(self):
+        raise TypeError("Shared cron slices are read-only, use job.slices")
+
+_SHARED_JOB = _SharedJob()
+_schedule_cache = OrderedDict()
+_schedule_lock = threading.Lock()
+
+def _shared_slices(fields):
+    """Return the read-only slices for five time fields, from the LRU cache"""
+    with _schedule_lock:
+        slices = _schedule_cache.pop(fields, None)
+        if slices is not None:
+            _schedule_cache[fields] = slices
+            return slices
+    slices = tuple([CronSlice(value=fields[i], **S_INFO[i]) for i in range(5)])
+    for vslice in slices:
+        vslice.job = _SHARED_JOB
+    with _schedule_lock:
+        _schedule_cache[fields] = slices
+        while len(_schedule_cache) > SCHEDULE_CACHE_SIZE:
+            _schedule_cache.popitem(last=False)
+    return slices
+
+
+def _index_keys(item):
+    """Return the command and comment a CronTab indexes an item under"""
+    command = item.command and item.command._command or ''
+    return (command, item.meta())
+
+
 def get_cronvalue(value, enums):
     """Returns a value as int (pass-through) or a special enum value"""
     if isinstance(value, int):
@@ -657,6 +1410,8 @@ def get_cronvalue(value, enums):
 
 class CronValue(object):
     """Represent a special value in the cron line"""
+    __slots__ = ('enum', 'value')
+
     def __init__(self, value, enums):
         self.enum = value
         self.value = enums.index(value.lower())
@@ -674,7 +1429,7 @@ class CronValue(object):
 def _render_values(values, sep=',', resolve=False):
     """Returns a rendered list, sorted and optionally resolved"""
     if len(values) > 1:
-        values.sort()
+        values.sort(key=int)
     return sep.join([ _render(val, resolve) for val in values ])
 
 def _render(value, resolve=False):
@@ -689,10 +1444,15 @@ def _render(value, resolve=False):
 
 class CronRange(object):
     """A range between one value and another for a time range."""
+    __slots__ = ('slice', 'seq', 'cron', 'vfrom', 'vto', 'star')
+
     def __init__(self, vslice, *vrange):
         self.slice = vslice
         self.seq   = 1
         self.cron  = None
+        # Written as '*', which cron treats differently from the same
+        # range spelt out in the day fields.
+        self.star  = False
 
         if not vrange:
             self.all()
@@ -723,20 +1483,29 @@ class CronRange(object):
         """Set this slice to all units between the miniumum and maximum"""
         self.vfrom = self.slice.min
         self.vto  = self.slice.max
+        self.star = True
 
     def render(self, resolve=False):
         """Render the ranged value for a cronjob"""
         value = '*'
-        if int(self.vfrom) > self.slice.min or int(self.vto) < self.slice.max:
+        if not self.star:
             value = _render_values([self.vfrom, self.vto], '-', resolve)
         if self.seq != 1:
             value += "/%d" % self.seq
-        if value != '*' and SystemV:
+        if value != '*' and system_v():
             value = ','.join(map(str, range(self.vfrom, self.vto+1, self.seq)))
         return value
 
+    def _copy(self, vslice):
+        """Return a copy of this range belonging to vslice"""
+        result = CronRange(vslice)
+        (result.vfrom, result.vto, result.seq, result.star) = (
+            self.vfrom, self.vto, self.seq, self.star)
+        return result
+
     def every(self, value):
         """Set the sequence value for this range."""
+        self.slice._changed()
         self.seq = int(value)
 
     def __lt__(self, value):
@@ -754,6 +1523,8 @@ class CronRange(object):
 
 class CronCommand(object):
     """Represent a cron command as an object."""
+    __slots__ = ('_command',)
+
     def __init__(self, line):
         self._command = line
 
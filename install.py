@@ -3,18 +3,22 @@
 from crontab import CronTab
 import json
 import os
+import sys
 from shutil import copyfile
 
 install_dir = '/usr/local/bin/send_email'
 config = json.loads(open('CONFIG.private').read())
+# With --daemon, a long-running send_email_daemon.py is started at boot
+# instead of running send_email.py from cron.
+use_daemon = '--daemon' in sys.argv[1:]
 
 # Installing the script to /usr/local/bin/send_email
 if os.path.exists(install_dir):
-  print 'Install directory already existed.'
+  print('Install directory already existed.')
 else:
   os.makedirs(install_dir)
 
-files_to_install = ['send_email.py', 'crontab.py', 'CONFIG.private']
+files_to_install = ['send_email.py', 'mailer.py', 'message.py', 'schedule.py', 'ledger.py', 'metrics.py', 'ratelimit.py', 'spool.py', 'spool_flusher.py', 'send_email_daemon.py', 'crontab.py', 'cronlog.py', 'CONFIG.private']
 for filename in files_to_install:
   copyfile(filename, '%s/%s' % (install_dir, filename))
 
@@ -23,11 +27,30 @@ cron = CronTab()
 cmd = 'python %s/send_email' % (install_dir)
 for old_job in cron.find_command(cmd):
   cron.remove(old_job)
+for old_job in cron.find_command('python %s/spool_flusher' % (install_dir)):
+  cron.remove(old_job)
+
+# With a spool_dir, send_email.py only queues messages and the flusher,
+# started at boot, delivers them.
+if config.get('spool_dir'):
+  flusher = cron.new(command='python %s/spool_flusher.py' % (install_dir))
+  flusher.every_reboot()
 
-job = cron.new(command='python %s/send_email.py' % (install_dir))
+if use_daemon:
+  job = cron.new(command='python %s/send_email_daemon.py' % (install_dir))
+  job.every_reboot()
+else:
+  job = cron.new(command='python %s/send_email.py' % (install_dir))
 job.enable()
 #job.minute.on(0)
 #for hour in config['send_times']:
 #  job.hour.also.on(hour)
 
 cron.write()
+
+if use_daemon:
+  print('Installed the daemon to start at boot. To start it now, run:')
+  print('  nohup python %s/send_email_daemon.py &' % (install_dir))
+if config.get('spool_dir'):
+  print('Installed the spool flusher to start at boot. To start it now, run:')
+  print('  nohup python %s/spool_flusher.py &' % (install_dir))
@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+import time
+
+class SendLedger(object):
+  """
+  Durable record of which (day, receiver, slot) sends have completed, so a
+  restarted run can skip them.
+
+  Records are committed in batches of batch_size; a crash can lose at most
+  the last uncommitted batch, and those receivers would be sent to again.
+
+  Each record also says when it was made and which relay sent it, so later
+  runs can count earlier sends against the rate limits.
+  """
+  def __init__(self, path, batch_size=100):
+    # Without a path the ledger only lasts for this run.
+    self.db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('CREATE TABLE IF NOT EXISTS sent ('
+                    'day TEXT, receiver TEXT, slot INTEGER, sent_at REAL, '
+                    'PRIMARY KEY (day, receiver, slot))')
+    columns = [row[1] for row in self.db.execute('PRAGMA table_info(sent)')]
+    if 'relay' not in columns:
+      # Ledgers written before the relay was recorded.
+      self.db.execute('ALTER TABLE sent ADD COLUMN relay TEXT')
+    self.db.execute('CREATE INDEX IF NOT EXISTS sent_at ON sent (sent_at)')
+    self.db.commit()
+    self.batch_size = max(1, int(batch_size))
+    self.pending = 0
+    self.lock = threading.Lock()
+
+  def completed(self, day, slot):
+    """Return the set of receivers already sent to for this day and slot."""
+    rows = self.db.execute('SELECT receiver FROM sent WHERE day = ? AND slot = ?',
+                           (day, slot))
+    return set(receiver for (receiver,) in rows)
+
+  def sends_since(self, stamp):
+    """
+    Return (sent_at, receiver, relay) for each send through a relay after
+    stamp, oldest first.
+    """
+    return self.db.execute('SELECT sent_at, receiver, relay FROM sent '
+                           'WHERE sent_at > ? AND relay IS NOT NULL '
+                           'ORDER BY sent_at', (stamp,)).fetchall()
+
+  def record(self, day, receiver, slot, relay=None):
+    with self.lock:
+      self.db.execute('INSERT OR IGNORE INTO sent '
+                      '(day, receiver, slot, sent_at, relay) '
+                      'VALUES (?, ?, ?, ?, ?)',
+                      (day, receiver, slot, time.time(), relay))
+      self.pending += 1
+      if self.pending >= self.batch_size:
+        self._commit()
+
+  def commit(self):
+    with self.lock:
+      self._commit()
+
+  def close(self):
+    self.commit()
+    self.db.close()
+
+  def _commit(self):
+    if self.pending:
+      self.db.commit()
+      self.pending = 0
@@ -0,0 +1,361 @@
+import random
+import smtplib
+import socket
+import threading
+import time
+
+from metrics import NULL_METRICS
+from ratelimit import RateLimiter
+
+try:
+  from queue import Queue, Empty
+except ImportError:
+  from Queue import Queue, Empty
+
+# Reply code servers use when they drop the session, e.g. once a
+# per-connection message cap has been reached.
+SERVICE_CLOSING = 421
+# Weight of the newest sample in each relay's moving averages.
+SMOOTHING = 0.2
+# Floors for a relay's latency and health when sharing out traffic, so an
+# unmeasured relay is tried and a failing one still gets the odd message to
+# show whether it has recovered.
+MIN_LATENCY = 0.01
+MIN_HEALTH = 0.05
+# Reply code for a mailbox name that is not allowed, given to addresses that
+# cannot be sent without SMTPUTF8.
+BAD_MAILBOX = 553
+# Stands in for the result of a message that has not been tried yet.
+PENDING = object()
+
+def dropped(error):
+  """Return True if error means the server closed the session on us."""
+  if isinstance(error, smtplib.SMTPResponseException):
+    return error.smtp_code == SERVICE_CLOSING
+  if isinstance(error, smtplib.SMTPServerDisconnected):
+    return True
+  # SMTPException derives from socket.error on Python 3.
+  return isinstance(error, socket.error) and \
+      not isinstance(error, smtplib.SMTPException)
+
+def relay_fault(error):
+  """
+  Return True if error says more about the relay than about the message:
+  the connection or login failed, or the relay answered with a temporary
+  (4xx) error. Such messages are worth retrying on another relay.
+  """
+  if isinstance(error, smtplib.SMTPRecipientsRefused):
+    return False
+  if isinstance(error, (smtplib.SMTPServerDisconnected,
+                        smtplib.SMTPAuthenticationError,
+                        smtplib.SMTPHeloError)):
+    return True
+  if isinstance(error, smtplib.SMTPResponseException):
+    return 400 <= error.smtp_code < 500
+  return isinstance(error, socket.error) and \
+      not isinstance(error, smtplib.SMTPException)
+
+def recipient_errors(to_addrs, error):
+  """
+  Split the result of sending one message into one entry per address in
+  to_addrs: None if it was accepted, otherwise the error. Refusals of only
+  some recipients come back as SMTPRecipientsRefused, as when all are refused.
+  """
+  if isinstance(error, smtplib.SMTPRecipientsRefused):
+    return [smtplib.SMTPRecipientsRefused({address: error.recipients[address]})
+            if address in error.recipients else None
+            for address in to_addrs]
+  return [error] * len(to_addrs)
+
+def is_ascii_address(address):
+  try:
+    address.encode('ascii')
+  except UnicodeError:
+    return False
+  return True
+
+def merge_refusals(error, refused):
+  """
+  Add the refusals in refused (address -> (code, reply)) to the result of
+  sending a message.
+  """
+  if not refused or (error is not None and
+                     not isinstance(error, smtplib.SMTPRecipientsRefused)):
+    return error
+  if error is not None:
+    refused = dict(refused)
+    refused.update(error.recipients)
+  return smtplib.SMTPRecipientsRefused(refused)
+
+class SMTPSession(object):
+  """
+  One authenticated SMTP connection that is reused across messages.
+
+  The connection is opened lazily, re-opened transparently when the server
+  drops it, and recycled after max_messages_per_session messages when the
+  config sets that cap.
+  """
+  def __init__(self, config, metrics=NULL_METRICS):
+    self.config = config
+    self.metrics = metrics
+    self.max_messages = config.get('max_messages_per_session')
+    self.server = None
+    # Number of messages sent over each connection, in order.
+    self.session_counts = []
+
+  def connect(self):
+    self.close()
+    with self.metrics.timer('smtp_connect'):
+      server = smtplib.SMTP(self.config['mail_server'])
+    try:
+      if self.config.get('starttls', True):
+        with self.metrics.timer('starttls'):
+          server.starttls()
+      if self.config.get('username'):
+        with self.metrics.timer('auth'):
+          server.login(self.config['username'], self.config['password'])
+    except Exception:
+      # Do not leave the socket open when the session could not be set up.
+      server.close()
+      raise
+    self.server = server
+    self.session_counts.append(0)
+
+  def close(self):
+    if self.server is None:
+      return
+    try:
+      self.server.quit()
+    except (smtplib.SMTPException, socket.error):
+      pass
+    self.server = None
+
+  def sendmail(self, from_addr, to_addrs, msg):
+    if self.server is None or self._at_cap():
+      self.connect()
+    try:
+      with self.metrics.timer('data'):
+        refused = self.server.sendmail(from_addr, to_addrs, msg)
+    except Exception as e:
+      if not dropped(e):
+        raise
+      self.metrics.count('reconnects')
+      self.server = None
+      self.connect()
+      with self.metrics.timer('data'):
+        refused = self.server.sendmail(from_addr, to_addrs, msg)
+    self.session_counts[-1] += 1
+    return refused
+
+  def _at_cap(self):
+    return bool(self.max_messages) and \
+        self.session_counts[-1] >= self.max_messages
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class Relay(object):
+  """
+  One mail server to send through, with moving averages of its latency and
+  error rate over this run.
+
+  relay_config entries (mail_server, username, password, starttls, weight)
+  override the top-level config, so relays can share credentials.
+  """
+  def __init__(self, config, relay_config):
+    self.config = dict(config)
+    self.config.update(relay_config)
+    self.name = self.config['mail_server']
+    self.weight = float(self.config.get('weight', 1))
+    self.latency = None
+    self.error_rate = 0.0
+    self.sent = 0
+    self.errors = 0
+    self.lock = threading.Lock()
+
+  def share(self):
+    """How much traffic this relay should get relative to the others."""
+    health = max(1 - self.error_rate, MIN_HEALTH)
+    return self.weight * health / max(self.latency or 0, MIN_LATENCY)
+
+  def record(self, seconds, failed):
+    with self.lock:
+      self.error_rate += SMOOTHING * (float(failed) - self.error_rate)
+      if failed:
+        self.errors += 1
+        return
+      self.sent += 1
+      if self.latency is None:
+        self.latency = seconds
+      else:
+        self.latency += SMOOTHING * (seconds - self.latency)
+
+  def summary(self):
+    return '%s: %d sent, %d errors, %.3fs latency, %.0f%% recent errors' % (
+        self.name, self.sent, self.errors, self.latency or 0,
+        100 * self.error_rate)
+
+
+class RelaySet(object):
+  """
+  The relays from the config's relays list, or just its mail_server. Each
+  message goes to a relay picked at random in proportion to Relay.share().
+  """
+  def __init__(self, config):
+    self.relays = [Relay(config, relay_config)
+                   for relay_config in config.get('relays') or [{}]]
+    self.random = random.Random()
+
+  def __len__(self):
+    return len(self.relays)
+
+  def choose(self, exclude=()):
+    """Pick a relay not in exclude, or return None if there are none left."""
+    candidates = [(relay, relay.share()) for relay in self.relays
+                  if relay not in exclude]
+    if not candidates:
+      return None
+    pick = self.random.uniform(0, sum(share for (_, share) in candidates))
+    for relay, share in candidates:
+      pick -= share
+      if pick <= 0:
+        return relay
+    return candidates[-1][0]
+
+
+class DeliveryPool(object):
+  """
+  Spreads messages across parallel_sessions worker threads. Each worker keeps
+  one SMTPSession per relay it has used. A message that fails because of its
+  relay is retried on each of the other relays in turn; any other failure
+  only affects the message that caused it. Messages wait for the relay's and
+  their domains' rate limits before they are sent. Pass in a limiter to
+  share its limits with other pools, such as later passes of a long-running
+  process.
+  """
+  def __init__(self, config, metrics=NULL_METRICS, limiter=None):
+    self.config = config
+    self.metrics = metrics
+    self.size = max(1, int(config.get('parallel_sessions', 1)))
+    self.relays = RelaySet(config)
+    self.limiter = limiter or RateLimiter(config)
+    self.sessions = []
+    self.sessions_lock = threading.Lock()
+    self.sent_through = {}
+
+  def send_all(self, from_addr, messages, on_result=None):
+    """
+    Send a list of (to_addrs, msg) pairs. Returns one entry per message, in
+    the same order: None when it was sent, otherwise the exception raised.
+    msg may also be a function returning the message, so that messages are
+    only built by the workers as they are sent. When a message with several
+    recipients is refused for only some of them, its entry is an
+    SMTPRecipientsRefused for those; see recipient_errors.
+
+    Addresses that are not ASCII are refused with BAD_MAILBOX without being
+    sent to, since smtplib cannot send them without SMTPUTF8.
+
+    on_result(index, error) is called from the worker thread as soon as
+    each message is done. By then sent_through[index] holds the name of the
+    relay the message was last tried on.
+    """
+    self.sent_through = {}
+    jobs = Queue()
+    results = [PENDING] * len(messages)
+    for index, (to_addrs, msg) in enumerate(messages):
+      refused = dict((address, (BAD_MAILBOX, b'address is not ASCII'))
+                     for address in to_addrs if not is_ascii_address(address))
+      to_addrs = [address for address in to_addrs if address not in refused]
+      if to_addrs:
+        jobs.put((index, (to_addrs, msg, refused)))
+        continue
+      results[index] = smtplib.SMTPRecipientsRefused(refused)
+      if on_result:
+        on_result(index, results[index])
+    workers = []
+    for _ in range(min(self.size, jobs.qsize())):
+      worker = threading.Thread(target=self._work,
+                                args=(from_addr, jobs, results, on_result))
+      worker.start()
+      workers.append(worker)
+    for worker in workers:
+      worker.join()
+    # Only left if on_result raised and stopped a worker.
+    return [RuntimeError('not sent: its worker stopped')
+            if result is PENDING else result for result in results]
+
+  def summary(self):
+    counts = [n for session in self.sessions for n in session.session_counts]
+    lines = ['Sent %d messages over %d SMTP sessions %s' % (
+        sum(counts), len(counts), counts)]
+    if len(self.relays) > 1:
+      lines.extend('  ' + relay.summary() for relay in self.relays.relays)
+    if self.limiter.summary():
+      lines.append(self.limiter.summary())
+    return '\n'.join(lines)
+
+  def _work(self, from_addr, jobs, results, on_result):
+    sessions = {}
+    try:
+      while True:
+        try:
+          index, (to_addrs, msg, refused) = jobs.get_nowait()
+        except Empty:
+          return
+        # Whatever goes wrong with one message, such as a template or
+        # encoding error, is its result and must not stop the others.
+        try:
+          if callable(msg):
+            msg = msg()
+          result, relay = self._deliver(sessions, from_addr, to_addrs, msg)
+          self.sent_through[index] = relay.name
+        except Exception as e:
+          result = e
+        results[index] = merge_refusals(result, refused)
+        if on_result:
+          on_result(index, results[index])
+    finally:
+      for session in sessions.values():
+        session.close()
+
+  def _deliver(self, sessions, from_addr, to_addrs, msg):
+    """
+    Send one message, failing over between relays. Returns its result and
+    the relay it was last tried on.
+    """
+    tried = []
+    while True:
+      # Prefer a relay that is not being held back by its rate limits.
+      relay = self.relays.choose(
+          tried + self.limiter.busy(self.relays.relays, to_addrs)) or \
+          self.relays.choose(tried)
+      tried.append(relay)
+      session = sessions.get(relay)
+      if session is None:
+        session = sessions[relay] = SMTPSession(relay.config, self.metrics)
+        with self.sessions_lock:
+          self.sessions.append(session)
+      throttled = self.limiter.acquire(relay, to_addrs)
+      if throttled:
+        self.metrics.observe('throttled', throttled)
+      start = time.time()
+      try:
+        refused = session.sendmail(from_addr, to_addrs, msg)
+      except (smtplib.SMTPException, socket.error) as e:
+        fault = relay_fault(e)
+        relay.record(time.time() - start, fault)
+        if not fault:
+          return e, relay
+        self.metrics.count('relay_errors', relay=relay.name)
+        session.close()
+        if len(tried) == len(self.relays):
+          return e, relay
+        continue
+      relay.record(time.time() - start, False)
+      if refused:
+        return smtplib.SMTPRecipientsRefused(refused), relay
+      return None, relay
@@ -0,0 +1,136 @@
+import binascii
+from email.header import Header
+from email.utils import formatdate
+import itertools
+import os
+from string import Template
+import time
+
+CRLF = b'\r\n'
+# Fields filled in for every receiver; anything else after a $ is sent as is.
+RECEIVER_FIELDS = ('name', 'receiver')
+
+def is_ascii(data):
+  try:
+    data.decode('ascii')
+  except UnicodeError:
+    return False
+  return True
+
+def encode_header(text):
+  """Encode a header value as RFC 2047 words if it is not plain ASCII."""
+  if is_ascii(text.encode('utf-8')):
+    return text.encode('ascii')
+  return Header(text, 'utf-8').encode().encode('ascii')
+
+def encode_body(body):
+  """Return (Content-Transfer-Encoding, encoded body) for a UTF-8 body."""
+  body = body.replace(CRLF, b'\n').replace(b'\n', CRLF)
+  if is_ascii(body):
+    return b'7bit', body
+  # 57 input bytes become one 76 character line.
+  return b'base64', b''.join(
+      binascii.b2a_base64(body[start:start + 57])
+      for start in range(0, len(body), 57)).replace(b'\n', CRLF)
+
+class CompiledText(object):
+  """
+  A $-template split once into UTF-8 encoded literal chunks and the names of
+  the per-receiver fields between them. Fields known when compiling are
+  filled in then; $$ and unknown placeholders are kept as text, like
+  Template.safe_substitute.
+  """
+  def __init__(self, text, constants):
+    self.chunks = []
+    self.fields = []
+    literal = []
+    position = 0
+    for match in Template.pattern.finditer(text):
+      literal.append(text[position:match.start()])
+      position = match.end()
+      name = match.group('named') or match.group('braced')
+      if match.group('escaped') is not None:
+        literal.append('$')
+      elif name in constants:
+        literal.append(constants[name])
+      elif name in RECEIVER_FIELDS:
+        self.chunks.append(''.join(literal).encode('utf-8'))
+        self.fields.append(name)
+        literal = []
+      else:
+        literal.append(match.group())
+    literal.append(text[position:])
+    self.chunks.append(''.join(literal).encode('utf-8'))
+
+  def fill(self, values):
+    if not self.fields:
+      return self.chunks[0]
+    parts = [self.chunks[0]]
+    for field, chunk in zip(self.fields, self.chunks[1:]):
+      parts.append(values[field].encode('utf-8'))
+      parts.append(chunk)
+    return b''.join(parts)
+
+
+class MessageTemplate(object):
+  """
+  The msg_subject and msg_text of a config, compiled once per run.
+
+  Both may use $name (the schedule's optional third column, or the receiver
+  when it is missing), $receiver and $date (the day of the run, formatted
+  with the config's date_format). Everything that is the same for every
+  receiver is encoded up front, so render only fills in the fields and the
+  To header.
+  """
+  def __init__(self, config, now):
+    constants = {'date': now.strftime(config.get('date_format', '%B %d'))}
+    self.subject = CompiledText(config['msg_subject'], constants)
+    self.body = CompiledText(config['msg_text'], constants)
+    self.static_subject = self.static_body = None
+    if not self.subject.fields:
+      self.static_subject = encode_header(
+          self.subject.fill(None).decode('utf-8'))
+    if not self.body.fields:
+      self.static_body = encode_body(self.body.fill(None))
+    self.head = CRLF.join([
+      b'From: ' + config['from_email'].encode('ascii'),
+      b'Date: ' + formatdate(time.mktime(now.timetuple()),
+                             localtime=True).encode('ascii'),
+      b'MIME-Version: 1.0',
+      b'Content-Type: text/plain; charset="utf-8"',
+    ]) + CRLF
+    self.id_prefix = ('<%d.%d.' % (time.time() * 1000, os.getpid())).encode('ascii')
+    self.id_suffix = ('@%s>' % (config['from_email'].rpartition('@')[2])).encode('ascii')
+    # Workers render concurrently; next() on a count is atomic.
+    self.ids = itertools.count(1)
+
+  def is_static(self):
+    """Return True if every receiver gets the same subject and text."""
+    return self.static_subject is not None and self.static_body is not None
+
+  def render(self, address, receiver, name=None):
+    """Return the full message for one receiver, ready for sendmail."""
+    values = {'name': name or receiver, 'receiver': receiver}
+    subject = self.static_subject
+    if subject is None:
+      subject = encode_header(self.subject.fill(values).decode('utf-8'))
+    encoding, body = self.static_body or encode_body(self.body.fill(values))
+    return self._assemble(address.encode('utf-8'), subject, encoding, body)
+
+  def render_batch(self):
+    """Return one message for a static template sent to many receivers."""
+    encoding, body = self.static_body
+    return self._assemble(b'undisclosed-recipients:;', self.static_subject,
+                          encoding, body)
+
+  def _assemble(self, to, subject, encoding, body):
+    return b''.join([
+      self.head,
+      b'Content-Transfer-Encoding: ', encoding, CRLF,
+      b'Message-ID: ', self.id_prefix, str(next(self.ids)).encode('ascii'),
+      self.id_suffix, CRLF,
+      b'To: ', to, CRLF,
+      b'Subject: ', subject, CRLF,
+      CRLF,
+      body,
+    ])
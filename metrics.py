@@ -0,0 +1,176 @@
+from bisect import bisect_left
+import json
+import os
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = 'send_email'
+
+def open_metrics(config, source=None):
+  """
+  Return a Metrics for this run, or NULL_METRICS if no output is set.
+
+  source names a program other than send_email.py, such as the spool
+  flusher. Its output then goes where <source>_metrics_json and
+  <source>_metrics_textfile say, under Prometheus names starting
+  send_email_<source>, so that it never overwrites send_email.py's.
+  """
+  keys = ['metrics_json', 'metrics_textfile']
+  prefix = PREFIX
+  if source:
+    keys = ['%s_%s' % (source, key) for key in keys]
+    prefix = '%s_%s' % (PREFIX, source)
+  json_path, textfile_path = [config.get(key) for key in keys]
+  if json_path or textfile_path:
+    return Metrics(json_path, textfile_path, prefix)
+  return NULL_METRICS
+
+def write_atomically(path, text):
+  # Readers such as node_exporter's textfile collector must never see a
+  # partially written file.
+  tmp_path = '%s.%d.tmp' % (path, os.getpid())
+  with open(tmp_path, 'w') as output:
+    output.write(text)
+  os.rename(tmp_path, path)
+
+class Histogram(object):
+  def __init__(self):
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.total = 0.0
+    self.max = 0.0
+
+  def observe(self, seconds):
+    self.counts[bisect_left(BUCKETS, seconds)] += 1
+    self.total += seconds
+    self.max = max(self.max, seconds)
+
+  def count(self):
+    return sum(self.counts)
+
+  def cumulative(self):
+    """Yield (upper bound, observations at or below it), ending with +Inf."""
+    seen = 0
+    for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+      seen += count
+      yield bound, seen
+
+
+class Timer(object):
+  """Context manager that observes its duration under a phase."""
+  def __init__(self, metrics, phase):
+    self.metrics = metrics
+    self.phase = phase
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.metrics.observe(self.phase, time.time() - self.start)
+    if exc_type is not None:
+      self.metrics.count('phase_errors', phase=self.phase)
+
+
+class Metrics(object):
+  """
+  Latency histograms per phase and labelled counters for one send run.
+
+  Phases are config_load, schedule_parse (rebuilding the schedule index when
+  the schedule has changed), schedule_lookup, smtp_connect, starttls, auth
+  and data (one SMTP transaction). Safe to update from the delivery threads.
+  """
+  def __init__(self, json_path=None, textfile_path=None, prefix=PREFIX):
+    self.json_path = json_path
+    self.textfile_path = textfile_path
+    self.prefix = prefix
+    self.histograms = {}
+    self.counters = {}
+    self.lock = threading.Lock()
+
+  def timer(self, phase):
+    return Timer(self, phase)
+
+  def observe(self, phase, seconds):
+    with self.lock:
+      if phase not in self.histograms:
+        self.histograms[phase] = Histogram()
+      self.histograms[phase].observe(seconds)
+
+  def count(self, name, n=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with self.lock:
+      self.counters[key] = self.counters.get(key, 0) + n
+
+  def summary(self):
+    phases = {}
+    for phase, histogram in self.histograms.items():
+      phases[phase] = {
+        'count': histogram.count(),
+        'sum': histogram.total,
+        'max': histogram.max,
+        'buckets': [[bound, seen] for bound, seen in histogram.cumulative()],
+      }
+    counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())]
+    return {'finished': time.time(), 'phases': phases, 'counters': counters}
+
+  def prometheus(self):
+    prefix = self.prefix
+    lines = [
+      '# HELP %s_phase_seconds Time spent in each phase of a send run.' % prefix,
+      '# TYPE %s_phase_seconds histogram' % prefix,
+    ]
+    for phase, histogram in sorted(self.histograms.items()):
+      for bound, seen in histogram.cumulative():
+        lines.append('%s_phase_seconds_bucket{phase="%s",le="%s"} %d' % (
+            prefix, phase, bound, seen))
+      lines.append('%s_phase_seconds_sum{phase="%s"} %f' % (
+          prefix, phase, histogram.total))
+      lines.append('%s_phase_seconds_count{phase="%s"} %d' % (
+          prefix, phase, histogram.count()))
+    typed = set()
+    for (name, labels), value in sorted(self.counters.items()):
+      if name not in typed:
+        lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+        typed.add(name)
+      label_text = ','.join('%s="%s"' % (key, str(label).replace('"', '\\"'))
+                            for key, label in labels)
+      if label_text:
+        label_text = '{%s}' % label_text
+      lines.append('%s_%s_total%s %d' % (prefix, name, label_text, value))
+    lines.append('# TYPE %s_last_run_timestamp_seconds gauge' % prefix)
+    lines.append('%s_last_run_timestamp_seconds %f' % (prefix, time.time()))
+    return '\n'.join(lines) + '\n'
+
+  def write(self):
+    with self.lock:
+      if self.json_path:
+        write_atomically(self.json_path,
+                         json.dumps(self.summary(), indent=2, sort_keys=True))
+      if self.textfile_path:
+        write_atomically(self.textfile_path, self.prometheus())
+
+
+class NullMetrics(object):
+  """Stands in for Metrics when instrumentation is off; every call is a no-op."""
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    pass
+
+  def timer(self, phase):
+    return self
+
+  def observe(self, phase, seconds):
+    pass
+
+  def count(self, name, n=1, **labels):
+    pass
+
+  def write(self):
+    pass
+
+NULL_METRICS = NullMetrics()
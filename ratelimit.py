@@ -0,0 +1,144 @@
+from collections import deque
+import threading
+import time
+
+# Config keys for sending limits, and the period each one covers in seconds.
+PERIODS = {
+  'max_per_second': 1,
+  'max_per_minute': 60,
+  'max_per_hour': 60 * 60,
+  'max_per_day': 24 * 60 * 60,
+}
+
+# How far back earlier sends can still count against a limit.
+LONGEST_PERIOD = max(PERIODS.values())
+
+def domain_of(address):
+  return address.rpartition('@')[2].lower()
+
+def windows_for(limits):
+  """Return a SlidingWindow for each max_per_* setting in limits."""
+  return [SlidingWindow(limits[key], period)
+          for key, period in sorted(PERIODS.items()) if limits.get(key)]
+
+class SlidingWindow(object):
+  """
+  Allows at most limit recipients in any period seconds, by remembering
+  when each batch in the last period was sent.
+  """
+  def __init__(self, limit, period):
+    self.limit = limit
+    self.period = period
+    self.sent = deque()
+    self.total = 0
+    self.stamp = time.time()
+
+  def wait(self, count, now):
+    """Seconds until count more recipients fit in the window."""
+    self.stamp = now
+    while self.sent and self.sent[0][0] <= now - self.period:
+      self.total -= self.sent.popleft()[1]
+    # A batch larger than the limit goes through once the window is empty.
+    excess = self.total + min(count, self.limit) - self.limit
+    if excess <= 0:
+      return 0.0
+    freed = 0
+    for stamp, sent in self.sent:
+      freed += sent
+      if freed >= excess:
+        return stamp + self.period - now
+
+  def take(self, count):
+    self.add(self.stamp, count)
+
+  def add(self, stamp, count=1):
+    """Count recipients sent at stamp, which must not be before the last."""
+    self.sent.append((stamp, count))
+    self.total += count
+
+
+class RateLimiter(object):
+  """
+  Holds each message back until every limit it falls under has room for all
+  its recipients: the max_per_* settings of the relay it is sent through,
+  and of each recipient's domain in the config's domain_limits.
+
+  Only the sends it is told about count: those made through it, and those
+  of earlier runs passed to preload().
+  """
+  def __init__(self, config):
+    self.domains = dict((domain.lower(), windows_for(limits)) for
+                        domain, limits in config.get('domain_limits', {}).items())
+    self.relays = {}
+    # Earlier sends through relays that have no windows yet.
+    self.history = {}
+    self.throttled = {}
+    self.lock = threading.Lock()
+
+  def preload(self, sends):
+    """
+    Count sends made before this limiter, such as by earlier runs, given
+    as (timestamp, relay name, address) oldest first. Call it before
+    sending anything.
+    """
+    with self.lock:
+      for stamp, relay_name, address in sends:
+        self.history.setdefault(relay_name, []).append(stamp)
+        for window in self.domains.get(domain_of(address), []):
+          window.add(stamp)
+
+  def busy(self, relays, to_addrs):
+    """Return the relays whose own limits would hold to_addrs back now."""
+    with self.lock:
+      now = time.time()
+      return [relay for relay in relays
+              if any(window.wait(len(to_addrs), now)
+                     for window in self._relay_windows(relay))]
+
+  def acquire(self, relay, to_addrs):
+    """Block until relay may send to to_addrs; return the seconds waited."""
+    domains = {}
+    for address in to_addrs:
+      domain = domain_of(address)
+      if domain in self.domains:
+        domains[domain] = domains.get(domain, 0) + 1
+    waited = 0.0
+    while True:
+      with self.lock:
+        limits = [('relay %s' % (relay.name), window, len(to_addrs))
+                  for window in self._relay_windows(relay)]
+        limits.extend(('domain %s' % (domain), window, count)
+                      for domain, count in domains.items()
+                      for window in self.domains[domain])
+        if not limits:
+          return waited
+        now = time.time()
+        delay, limit = max((window.wait(count, now), name)
+                           for (name, window, count) in limits)
+        if not delay:
+          for (_, window, count) in limits:
+            window.take(count)
+          return waited
+        self.throttled[limit] = self.throttled.get(limit, 0.0) + delay
+      time.sleep(delay)
+      waited += delay
+
+  def _relay_windows(self, relay):
+    if relay.name not in self.relays:
+      self.relays[relay.name] = windows_for(relay.config)
+      for stamp in self.history.pop(relay.name, []):
+        for window in self.relays[relay.name]:
+          window.add(stamp)
+    return self.relays[relay.name]
+
+  def summary(self):
+    """
+    Describe the time workers spent waiting on each limit, or return None.
+    Workers wait in parallel, so the total can be more than the run took.
+    """
+    if not self.throttled:
+      return None
+    return 'Workers spent %.1fs throttled: %s' % (
+        sum(self.throttled.values()),
+        ', '.join('%s %.1fs' % (limit, seconds)
+                  for limit, seconds in sorted(self.throttled.items())))
@@ -0,0 +1,154 @@
+import io
+import mmap
+import os
+import struct
+import sys
+
+# The index is a fixed header, a table with one (offset, length) slot per
+# (month, day) and the receivers for each day stored contiguously, each
+# followed by a newline. It is rebuilt whenever the schedule's mtime or size
+# changes.
+MAGIC = b'ESIDX002'
+HEADER = struct.Struct('<8sdQ')
+BUCKETS = 13 * 32
+TABLE = struct.Struct('<%dQ' % (2 * BUCKETS))
+# How many bytes of one day's receivers to hold before writing them out
+# while building the index.
+FLUSH_SIZE = 4096
+
+def bucket(month, day):
+  return month * 32 + day
+
+def parse_date(date_string):
+  # I assume that the dates are in mm/dd format
+  month, day = date_string.split('/')
+  month, day = int(month), int(day)
+  if not (1 <= month <= 12 and 1 <= day <= 31):
+    raise ValueError('no such date %s' % (date_string))
+  return month, day
+
+def report_error(path, line_no, line, reason):
+  sys.stderr.write('%s:%d: skipping %r: %s\n' % (path, line_no, line, reason))
+
+def read_schedule(path, on_error=report_error):
+  """
+  Yield (month, day, receiver) for each line of the schedule, reading one
+  line at a time. Malformed lines are passed to on_error with their line
+  number and skipped.
+  """
+  with io.open(path, encoding='utf-8') as schedule_file:
+    for line_no, line in enumerate(schedule_file, 1):
+      line = line.rstrip('\n')
+      if not line.strip():
+        continue
+      if '\t' not in line:
+        on_error(path, line_no, line, 'expected "mm/dd<tab>receiver"')
+        continue
+      date_string, receiver = line.split('\t', 1)
+      try:
+        month, day = parse_date(date_string)
+      except ValueError as e:
+        on_error(path, line_no, line, 'bad date: %s' % (e))
+        continue
+      if not receiver.strip():
+        on_error(path, line_no, line, 'missing receiver')
+        continue
+      yield month, day, receiver
+
+def build_index(schedule_path, index_path):
+  """
+  Compile the schedule into an index in two streaming passes: the first
+  sizes each day's bucket, the second writes receivers into place. Memory
+  use does not depend on the size of the schedule.
+  """
+  stat = os.stat(schedule_path)
+  sizes = [0] * BUCKETS
+  for month, day, receiver in read_schedule(schedule_path):
+    sizes[bucket(month, day)] += len(receiver.encode('utf-8')) + 1
+
+  table = [0] * (2 * BUCKETS)
+  offset = HEADER.size + TABLE.size
+  for key, size in enumerate(sizes):
+    table[2 * key] = offset
+    table[2 * key + 1] = size
+    offset += size
+
+  tmp_path = '%s.%d.tmp' % (index_path, os.getpid())
+  cursors = table[0::2]
+  pending = {}
+  def flush(key):
+    index_file.seek(cursors[key])
+    chunk = b''.join(pending.pop(key))
+    index_file.write(chunk)
+    cursors[key] += len(chunk)
+
+  with open(tmp_path, 'wb') as index_file:
+    index_file.write(HEADER.pack(MAGIC, stat.st_mtime, stat.st_size))
+    index_file.write(TABLE.pack(*table))
+    pending_size = [0] * BUCKETS
+    ignore = lambda *args: None
+    for month, day, receiver in read_schedule(schedule_path, ignore):
+      key = bucket(month, day)
+      record = receiver.encode('utf-8') + b'\n'
+      pending.setdefault(key, []).append(record)
+      pending_size[key] += len(record)
+      if pending_size[key] >= FLUSH_SIZE:
+        flush(key)
+        pending_size[key] = 0
+    for key in list(pending):
+      flush(key)
+  if cursors != [table[2 * key] + sizes[key] for key in range(BUCKETS)]:
+    os.remove(tmp_path)
+    raise IOError('%s changed while it was being indexed' % (schedule_path))
+  os.rename(tmp_path, index_path)
+
+
+class ScheduleIndex(object):
+  """
+  Memory-mapped (month, day) -> receivers index of a schedule file.
+
+  Looking up a day only touches that day's bucket, so it costs the same
+  however long the schedule is.
+  """
+  def __init__(self, schedule_path, index_path=None):
+    self.schedule_path = schedule_path
+    self.index_path = index_path or schedule_path + '.idx'
+    self.map = None
+    self.source = None
+
+  def refresh(self):
+    """Map the index, rebuilding it first if the schedule has changed."""
+    stat = os.stat(self.schedule_path)
+    source = (stat.st_mtime, stat.st_size)
+    if self.map is not None and self.source == source:
+      return
+    self.close()
+    if self._stored_source() != source:
+      build_index(self.schedule_path, self.index_path)
+    with open(self.index_path, 'rb') as index_file:
+      self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    self.source = source
+
+  def lookup(self, month, day):
+    self.refresh()
+    key = bucket(month, day)
+    start = HEADER.size + 2 * key * 8
+    offset, length = struct.unpack('<QQ', self.map[start:start + 16])
+    if not length:
+      return []
+    return self.map[offset:offset + length].decode('utf-8').split('\n')[:-1]
+
+  def close(self):
+    if self.map is not None:
+      self.map.close()
+      self.map = None
+
+  def _stored_source(self):
+    try:
+      with open(self.index_path, 'rb') as index_file:
+        magic, mtime, size = HEADER.unpack(index_file.read(HEADER.size))
+    except (IOError, OSError, struct.error):
+      return None
+    if magic != MAGIC:
+      return None
+    return (mtime, size)
@@ -1,30 +1,197 @@
-from datetime import date
+from datetime import datetime
+from functools import partial
 import json
-import smtplib
-
-def is_today(date_string):
-  # I assume that the dates are in mm/dd format
-  month, day = date_string.split('/')
-  return date.today().month == int(month) and date.today().day == int(day)
-
-def send_email(receiver, config):
-  def construct_address():
-	if '@' in receiver:
-	  return receiver
-	else:
-	  return receiver + config['receiver_domain_name']
-  server = smtplib.SMTP(config['mail_server'])
-  server.starttls()
-  server.login(config['username'], config['password'])
-  server.sendmail(config['from_email'], construct_address(), 'Subject: %s\n\n%s' % (config['msg_subject'], config['msg_text']))
-  server.quit()
+import sys
+import time
+
+from metrics import open_metrics
+from schedule import ScheduleIndex
 
 install_dir = '/usr/local/bin/send_email/'
-config = json.loads(open('%sCONFIG.private' % (install_dir)).read())
-schedule_file = open(config['email_schedule'])
-
-for line in schedule_file.read().splitlines():
-  date_string, receiver = line.split('\t')
-  if is_today(date_string):
-    send_email(receiver, config)
-    print 'Sent email to %s' % (receiver)
+
+def construct_address(receiver, config):
+  if '@' in receiver:
+    return receiver
+  else:
+    return receiver + config['receiver_domain_name']
+
+def current_slot(config, now):
+  """
+  Return the latest send time that has passed, which a run at now sends
+  for, or None if none has yet today. Without send_times every run of the
+  day shares slot 0.
+  """
+  send_times = config.get('send_times')
+  if not send_times:
+    return 0
+  passed = [hour for hour in send_times if hour <= now.hour]
+  return max(passed) if passed else None
+
+def load_config(path=None):
+  return json.loads(open(path or '%sCONFIG.private' % (install_dir)).read())
+
+def open_index(config):
+  return ScheduleIndex(config['email_schedule'], config.get('schedule_index'))
+
+def lock_run(config):
+  """
+  Take the lock that keeps two runs from sending at once, and return the
+  file holding it, or None if another run has it. The lock lives next to
+  the send ledger, or the schedule when there is no ledger.
+  """
+  import fcntl
+  path = (config.get('send_ledger') or config['email_schedule']) + '.lock'
+  lock_file = open(path, 'a')
+  try:
+    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except (IOError, OSError):
+    lock_file.close()
+    return None
+  return lock_file
+
+def run(config, index, now=None, metrics=None):
+  """
+  Send to everyone due at now and return the process exit status.
+
+  Metrics for the run are written when it finishes, if the config asks for
+  them.
+  """
+  metrics = metrics or open_metrics(config)
+  try:
+    return _run(config, index, now or datetime.now(), metrics)
+  finally:
+    metrics.write()
+
+def _run(config, index, now, metrics):
+  if current_slot(config, now) is None:
+    return 0
+  # Refreshing the index rebuilds it if the schedule has changed.
+  with metrics.timer('schedule_parse'):
+    index.refresh()
+  with metrics.timer('schedule_lookup'):
+    entries = index.lookup(now.month, now.day)
+  if not entries:
+    return 0
+  # cron starts a run every minute, and a long one must finish its receivers
+  # before the next looks at the ledger, or they get the email twice.
+  lock = lock_run(config)
+  if lock is None:
+    print('Another run is still sending, leaving this slot to it')
+    return 0
+  try:
+    return _send(config, now, entries, metrics)
+  finally:
+    lock.close()
+
+def _send(config, now, entries, metrics):
+  # Sending needs smtplib, email and sqlite3, which take longer to import
+  # than the rest of the run when nobody is due, so only load them now.
+  from ledger import SendLedger
+  from mailer import DeliveryPool, recipient_errors
+  from message import MessageTemplate
+  from ratelimit import LONGEST_PERIOD, RateLimiter
+
+  template = MessageTemplate(config, now)
+  # Schedule lines may have the receiver's name as a third column.
+  names = {}
+  receivers = []
+  for entry in entries:
+    receiver, _, name = entry.partition('\t')
+    receivers.append(receiver)
+    names[receiver] = name.strip()
+
+  day, slot = now.date().isoformat(), current_slot(config, now)
+  ledger = SendLedger(config.get('send_ledger'),
+                      config.get('ledger_batch_size', 100))
+  done = ledger.completed(day, slot)
+  skipped = len(receivers)
+  receivers = [receiver for receiver in receivers if receiver not in done]
+  skipped -= len(receivers)
+  metrics.count('recipients', skipped, outcome='skipped')
+  if skipped:
+    print('Skipping %d receivers already sent to in this slot' % (skipped))
+  if not receivers:
+    ledger.close()
+    return 0
+
+  # Receivers that get the same message can share one transaction with
+  # several RCPT TO commands.
+  batch_size = int(config.get('recipients_per_message') or 1)
+  if batch_size > 1 and template.is_static():
+    groups = [receivers[start:start + batch_size]
+              for start in range(0, len(receivers), batch_size)]
+  else:
+    groups = [[receiver] for receiver in receivers]
+  messages = []
+  for group in groups:
+    addresses = [construct_address(receiver, config) for receiver in group]
+    if len(group) == 1:
+      msg = partial(template.render, addresses[0], group[0], names[group[0]])
+    else:
+      msg = template.render_batch
+    messages.append((addresses, msg))
+
+  if config.get('spool_dir'):
+    # spool_flusher.py delivers and retries spooled messages, so they count
+    # as done for this run once they are written.
+    from spool import Spool
+    spool = Spool(config['spool_dir'])
+    try:
+      for group, (addresses, msg) in zip(groups, messages):
+        spool.enqueue(config['from_email'], addresses, msg())
+        for receiver in group:
+          ledger.record(day, receiver, slot)
+          print('Queued email to %s' % (receiver))
+        metrics.count('recipients', len(group), outcome='queued')
+    finally:
+      ledger.close()
+    return 0
+
+  def outcomes(position, error):
+    return zip(groups[position],
+               recipient_errors(messages[position][0], error))
+
+  # Sends from earlier runs still count against the hourly and daily limits.
+  limiter = RateLimiter(config)
+  limiter.preload((sent_at, relay, construct_address(receiver, config))
+                  for (sent_at, receiver, relay)
+                  in ledger.sends_since(time.time() - LONGEST_PERIOD))
+  pool = DeliveryPool(config, metrics, limiter)
+
+  def on_result(position, error):
+    for receiver, receiver_error in outcomes(position, error):
+      if receiver_error is None:
+        ledger.record(day, receiver, slot, pool.sent_through[position])
+
+  try:
+    results = pool.send_all(config['from_email'], messages, on_result)
+  finally:
+    ledger.close()
+  failed = 0
+  for position, error in enumerate(results):
+    for receiver, receiver_error in outcomes(position, error):
+      if receiver_error is None:
+        print('Sent email to %s' % (receiver))
+        metrics.count('recipients', outcome='sent')
+      else:
+        print('Failed to send email to %s: %s' % (receiver, receiver_error))
+        metrics.count('recipients', outcome='failed')
+        metrics.count('send_errors', error=type(receiver_error).__name__)
+        failed += 1
+  if receivers:
+    print(pool.summary())
+  return 1 if failed else 0
+
+def main(config_path=None):
+  start = time.time()
+  config = load_config(config_path)
+  metrics = open_metrics(config)
+  metrics.observe('config_load', time.time() - start)
+  index = open_index(config)
+  try:
+    return run(config, index, metrics=metrics)
+  finally:
+    index.close()
+
+if __name__ == '__main__':
+  sys.exit(main(*sys.argv[1:2]))
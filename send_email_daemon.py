@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+import heapq
+import os
+import sys
+import time
+import traceback
+
+import send_email
+
+# Longest the daemon sleeps before checking CONFIG.private for changes.
+POLL_INTERVAL = 5
+
+def next_fire(hour, after):
+  """Return the first time at hour:00 strictly after the given datetime."""
+  fire = after.replace(hour=hour, minute=0, second=0, microsecond=0)
+  if fire <= after:
+    fire += timedelta(days=1)
+  return fire
+
+class Daemon(object):
+  """
+  Keeps the config and schedule index loaded and sends at each of the
+  configured send_times, instead of starting a new process every cron tick.
+
+  Pending send times are kept in a heap of (timestamp, hour). The config is
+  re-read when its mtime changes; the schedule index rebuilds itself when
+  the schedule changes.
+  """
+  def __init__(self, config_path):
+    self.config_path = config_path
+    self.config_mtime = None
+    self.config = None
+    self.index = None
+    self.timers = []
+
+  def reload(self):
+    """
+    Re-read the config if it has changed. A config that cannot be loaded,
+    such as one caught half-saved, is reported and the previous config and
+    timers are kept until the file changes again.
+    """
+    try:
+      mtime = os.stat(self.config_path).st_mtime
+      if mtime == self.config_mtime:
+        return
+      self.config_mtime = mtime
+      config = send_email.load_config(self.config_path)
+      now = datetime.now()
+      timers = [(time.mktime(next_fire(hour, now).timetuple()), hour)
+                for hour in set(config.get('send_times', []))]
+      index = send_email.open_index(config)
+    except Exception:
+      print('Could not load %s, keeping the previous config:' % (
+          self.config_path))
+      traceback.print_exc()
+      sys.stdout.flush()
+      return
+    if self.index is not None:
+      self.index.close()
+    self.config, self.index = config, index
+    self.timers = timers
+    heapq.heapify(self.timers)
+
+  def run_forever(self):
+    while True:
+      self.reload()
+      if not self.timers:
+        time.sleep(POLL_INTERVAL)
+        continue
+      fire_at, hour = self.timers[0]
+      delay = fire_at - time.time()
+      if delay > 0:
+        time.sleep(min(delay, POLL_INTERVAL))
+        continue
+
+      when = datetime.fromtimestamp(fire_at)
+      heapq.heapreplace(self.timers,
+          (time.mktime(next_fire(hour, when).timetuple()), hour))
+      try:
+        send_email.run(self.config, self.index, when)
+      except Exception:
+        traceback.print_exc()
+      sys.stdout.flush()
+
+if __name__ == '__main__':
+  config_path = sys.argv[1] if len(sys.argv) > 1 else \
+      '%sCONFIG.private' % (send_email.install_dir)
+  Daemon(config_path).run_forever()
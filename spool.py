@@ -0,0 +1,109 @@
+import itertools
+import json
+import os
+import socket
+import time
+
+# Spooled messages are named "<unique>:<attempts>,<not before>", so the
+# flusher can find the due ones without opening them.
+INFO_SEPARATOR = ':'
+# Shared by every Spool in the process so that names never repeat.
+_counter = itertools.count()
+
+def entry_name(unique, attempts, not_before):
+  return '%s%s%d,%d' % (unique, INFO_SEPARATOR, attempts, not_before)
+
+def parse_name(name):
+  """Return (unique, attempts, not_before) for a spool file name."""
+  unique, _, info = name.rpartition(INFO_SEPARATOR)
+  attempts, not_before = info.split(',')
+  return unique, int(attempts), int(not_before)
+
+class Spool(object):
+  """
+  A maildir-style directory of outgoing messages, one file each.
+
+  Files are written under tmp/ and renamed into new/, so the flusher only
+  ever sees complete messages. Each file is a JSON line with the envelope
+  ({"from": ..., "to": [...]}) followed by the message itself. Messages
+  that will never be delivered are moved to dead/.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.tmp_dir = os.path.join(path, 'tmp')
+    self.new_dir = os.path.join(path, 'new')
+    self.dead_dir = os.path.join(path, 'dead')
+    for directory in (self.tmp_dir, self.new_dir, self.dead_dir):
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+    self.unique = '%d.%d_%%d.%s' % (time.time(), os.getpid(),
+                                    socket.gethostname().replace('/', '_')
+                                    .replace(INFO_SEPARATOR, '_'))
+
+  def enqueue(self, from_addr, to_addrs, msg, not_before=0):
+    """Atomically add a message to the spool and return its name."""
+    name = entry_name(self.unique % next(_counter), 0, not_before)
+    self._write(name, from_addr, to_addrs, msg)
+    return name
+
+  def due(self, now=None):
+    """Return the names of the messages to try now, oldest first."""
+    now = time.time() if now is None else now
+    names = []
+    for name in os.listdir(self.new_dir):
+      try:
+        _, _, not_before = parse_name(name)
+      except ValueError:
+        continue
+      if not_before <= now:
+        names.append((not_before, name))
+    return [name for (_, name) in sorted(names)]
+
+  def load(self, name):
+    """Return (from_addr, to_addrs, msg) for a spooled message."""
+    with open(os.path.join(self.new_dir, name), 'rb') as spooled:
+      envelope = json.loads(spooled.readline().decode('utf-8'))
+      return envelope['from'], envelope['to'], spooled.read()
+
+  def remove(self, name):
+    os.unlink(os.path.join(self.new_dir, name))
+
+  def retry(self, name, not_before, to_addrs=None):
+    """
+    Count a failed attempt and hold the message until not_before. If
+    to_addrs is given, only those recipients are tried again.
+    """
+    unique, attempts, _ = parse_name(name)
+    retry_name = entry_name(unique, attempts + 1, not_before)
+    if to_addrs is None:
+      os.rename(os.path.join(self.new_dir, name),
+                os.path.join(self.new_dir, retry_name))
+    else:
+      from_addr, _, msg = self.load(name)
+      self._write(retry_name, from_addr, to_addrs, msg)
+      self.remove(name)
+    return retry_name
+
+  def bury(self, name, reason, to_addrs=None):
+    """
+    Move a message to dead/, next to a .reason file saying why. If to_addrs
+    is given, a copy for just those recipients is buried instead and the
+    message stays in the spool.
+    """
+    if to_addrs is None:
+      os.rename(os.path.join(self.new_dir, name),
+                os.path.join(self.dead_dir, name))
+    else:
+      from_addr, _, msg = self.load(name)
+      name = entry_name(self.unique % next(_counter), 0, 0)
+      self._write(name, from_addr, to_addrs, msg, self.dead_dir)
+    with open(os.path.join(self.dead_dir, name + '.reason'), 'w') as output:
+      output.write('%s\n' % (reason))
+
+  def _write(self, name, from_addr, to_addrs, msg, directory=None):
+    tmp_path = os.path.join(self.tmp_dir, name)
+    with open(tmp_path, 'wb') as spooled:
+      spooled.write(json.dumps({'from': from_addr, 'to': to_addrs})
+                    .encode('utf-8') + b'\n')
+      spooled.write(msg)
+    os.rename(tmp_path, os.path.join(directory or self.new_dir, name))
@@ -0,0 +1,144 @@
+import random
+import smtplib
+import sys
+import threading
+import time
+import traceback
+
+import send_email
+from mailer import DeliveryPool, relay_fault
+from metrics import open_metrics
+from ratelimit import RateLimiter
+from spool import Spool, parse_name
+
+# Seconds between scans of the spool for due messages.
+POLL_INTERVAL = 5
+# Most messages handed to one DeliveryPool at a time.
+CHUNK_SIZE = 1000
+
+def backoff(attempts, base, limit):
+  """
+  Seconds to hold a message after its attempts-th failure: doubling from
+  base up to limit, with the second half of the wait picked at random so
+  retries from an outage do not all land at once.
+  """
+  delay = min(base * 2 ** (attempts - 1), limit)
+  return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+def temporary_refusals(to_addrs, error):
+  """Split refused recipients into (temporary, permanent) lists."""
+  temporary, permanent = [], []
+  for address in to_addrs:
+    if address in error.recipients:
+      code = error.recipients[address][0]
+      (temporary if 400 <= code < 500 else permanent).append(address)
+  return temporary, permanent
+
+class Flusher(object):
+  """
+  Delivers the messages in the spool_dir spool. Messages that fail for a
+  temporary reason are retried with exponential backoff, up to
+  spool_max_attempts tries; the rest go to the spool's dead/ folder.
+  """
+  def __init__(self, config):
+    self.config = config
+    self.spool = Spool(config['spool_dir'])
+    self.max_attempts = int(config.get('spool_max_attempts', 8))
+    self.retry_base = float(config.get('spool_retry_base', 60))
+    self.retry_max = float(config.get('spool_retry_max', 3600))
+    self.counts = {'sent': 0, 'retried': 0, 'dead': 0}
+    # Shared by every pass, so the limits hold across them.
+    self.limiter = RateLimiter(config)
+    self.lock = threading.Lock()
+
+  def flush(self, now=None):
+    """Try every due message once and return how many were tried."""
+    names = self.spool.due(now)
+    if not names:
+      return 0
+    metrics = open_metrics(self.config, 'spool')
+    try:
+      for start in range(0, len(names), CHUNK_SIZE):
+        self._flush_chunk(names[start:start + CHUNK_SIZE], metrics)
+    finally:
+      metrics.write()
+    return len(names)
+
+  def _flush_chunk(self, names, metrics):
+    by_sender = {}
+    for name in names:
+      try:
+        from_addr, to_addrs, msg = self.spool.load(name)
+      except (IOError, OSError):
+        # Already handled by another flusher.
+        continue
+      except (ValueError, KeyError) as e:
+        self.spool.bury(name, 'unreadable spool file: %s' % (e))
+        self._count('dead')
+        continue
+      by_sender.setdefault(from_addr, []).append((name, to_addrs, msg))
+
+    for from_addr, spooled in by_sender.items():
+      def on_result(position, error):
+        name, to_addrs, _ = spooled[position]
+        self._count(self._settle(name, to_addrs, error))
+      pool = DeliveryPool(self.config, metrics, self.limiter)
+      pool.send_all(from_addr, [(to_addrs, msg) for (_, to_addrs, msg)
+                                in spooled], on_result)
+
+  def _settle(self, name, to_addrs, error):
+    """Remove, reschedule or bury a message after an attempt."""
+    if error is None:
+      self.spool.remove(name)
+      return 'sent'
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+      temporary, permanent = temporary_refusals(to_addrs, error)
+    elif relay_fault(error):
+      temporary, permanent = to_addrs, []
+    else:
+      temporary, permanent = [], to_addrs
+    attempts = parse_name(name)[1] + 1
+    retry = temporary and attempts < self.max_attempts
+    dead = permanent if retry else permanent + temporary
+    whole = set(dead) == set(to_addrs)
+    if dead:
+      self.spool.bury(name, error, None if whole else dead)
+      print('Gave up on %s: %s' % (', '.join(dead), error))
+    if retry:
+      delay = backoff(attempts, self.retry_base, self.retry_max)
+      self.spool.retry(name, time.time() + delay,
+                       None if temporary == to_addrs else temporary)
+      print('Will retry %s in %ds: %s' % (', '.join(temporary), delay, error))
+      return 'retried'
+    if not whole:
+      self.spool.remove(name)
+    return 'dead'
+
+  def _count(self, outcome):
+    with self.lock:
+      self.counts[outcome] += 1
+
+  def run_forever(self):
+    while True:
+      try:
+        if self.flush():
+          print('Spool: %(sent)d sent, %(retried)d retried, %(dead)d dead' % (
+              self.counts))
+      except Exception:
+        traceback.print_exc()
+      sys.stdout.flush()
+      time.sleep(POLL_INTERVAL)
+
+def main(args):
+  once = '--once' in args
+  args = [arg for arg in args if arg != '--once']
+  flusher = Flusher(send_email.load_config(*args[:1]))
+  if not once:
+    flusher.run_forever()
+  flusher.flush()
+  print('Spool: %(sent)d sent, %(retried)d retried, %(dead)d dead' % (
+      flusher.counts))
+  return 1 if flusher.counts['dead'] else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))